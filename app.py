@@ -1,25 +1,108 @@
 """
 Main application for Gmail invoice processing automation
 """
-import schedule
 import time
-from typing import List
+_STARTED = time.perf_counter()
+
+import argparse
+import itertools
+import schedule
+import threading
+from typing import Iterator, List, Optional
 
 # Import our services
 from services.auth_service import AuthService
-from services.gmail_service import GmailService
+from services.gmail_service import GmailService, HistoryExpiredError
+from services.local_mailbox import LocalMailboxService
 from services.drive_service import DriveService
-from services.sheets_service import SheetsService
+from services.sheets_service import SheetsService, BufferedSheetWriter
 from services.invoice_extractor import ExtractionService
-from config import SUPPORTED_MIME_TYPES, SCHEDULE_HOURS
+from services.pipeline import Stage, StagedPipeline
+from services.sync_checkpoint import SyncCheckpoint
+from services import work_journal
+from services.work_journal import WorkJournal, reached
+from services.lazy_import import import_report, record_timing
+from services.metrics import metrics
+from services.accounts import Account
+from backfill import live_search_window
+from services.rate_limit import AccountBudget, use_account_budget, release_account_budget
+from config import (
+    SCHEDULE_HOURS, PIPELINE_STAGES,
+    GMAIL_FETCH_BATCH_SIZE, GMAIL_MARK_BATCH_SIZE,
+    GMAIL_MAX_MESSAGES, SYNC_MODE,
+    SHEETS_BATCH_ROWS, SHEETS_BATCH_MAX_AGE_SECONDS, DUPLICATE_INVOICE_ACTION,
+    METRICS_TEXTFILE, METRICS_HTTP_PORT, METRICS_SUMMARY_DIR
+)
+
+record_timing('app (eager imports)', time.perf_counter() - _STARTED)
+
+
+class AttachmentJob:
+    """A single attachment moving through the processing pipeline"""
+    
+    def __init__(self, email_id: str, attachment: dict):
+        self.email_id = email_id
+        self.attachment = attachment
+        self.file_data = None
+        self.invoice_data = {}
+        self.file_url = ''
+        self.duplicate = False
+        # Last stage completed by an earlier run, from the work journal
+        self.resumed_stage = None
+    
+    @property
+    def key(self) -> str:
+        """Stable identity across runs (attachment IDs change per fetch)"""
+        return f"{self.email_id}:{self.attachment.get('partId') or self.filename}"
+    
+    def resume_from(self, entry: dict):
+        self.resumed_stage = entry['stage']
+        self.invoice_data = entry['invoice_data']
+        self.file_url = entry['file_url']
+    
+    @property
+    def filename(self) -> str:
+        return self.attachment['filename']
+    
+    @property
+    def mime_type(self) -> str:
+        return self.attachment['mimeType']
+    
+    def release(self):
+        """Drop the attachment content (and any spooled temp file)"""
+        if self.file_data is not None:
+            self.file_data.close()
+            self.file_data = None
+
 
 class InvoiceProcessor:
-    def __init__(self):
-        self.auth_service = AuthService()
+    def __init__(self, account: Optional[Account] = None,
+                 max_messages: Optional[int] = GMAIL_MAX_MESSAGES):
+        """
+        account selects the mailbox, credentials and targets (config.py's
+        when omitted); max_messages caps the emails listed per run.
+        """
+        self.account = account or Account.default()
+        self.max_messages = max_messages
+        # The multi-mailbox runner resets and publishes metrics itself
+        self.owns_metrics = True
+        self.budget = AccountBudget(self.account.name, self.account.api_calls_per_minute)
+        self.auth_service = AuthService(self.account.token_file, self.account.credentials_file)
         self.gmail_service = None
         self.drive_service = None
         self.sheets_service = None
         self.extraction_service = ExtractionService()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._processed_count = 0
+        self._listed_count = 0
+        self._processed_emails = []
+        self._run_incomplete = False
+        self._next_history_id = None
+        self._filter_subject = False
+        self.checkpoint = SyncCheckpoint(self.account.sync_checkpoint_file)
+        self._sheet_writer = None
+        self.journal = WorkJournal(self.account.work_journal_path)
         
     def initialize_services(self):
         """Initialize all Google API services"""
@@ -29,14 +112,12 @@ class InvoiceProcessor:
             # Authenticate
             self.auth_service.authenticate()
             
-            # Initialize services
+            # Initialize services; Drive and Sheets wait until there is mail
             gmail_api = self.auth_service.get_gmail_service()
-            drive_api = self.auth_service.get_drive_service()
-            sheets_api = self.auth_service.get_sheets_service()
-            
-            self.gmail_service = GmailService(gmail_api)
-            self.drive_service = DriveService(drive_api)
-            self.sheets_service = SheetsService(sheets_api)
+            self.gmail_service = GmailService(
+                gmail_api, target_subject=self.account.target_subject,
+                label_name=self.account.label_name
+            )
             
             # Setup Gmail label
             self.gmail_service.get_or_create_label()
@@ -47,99 +128,358 @@ class InvoiceProcessor:
             print(f"Failed to initialize services: {e}")
             raise
     
-    def process_emails(self):
-        """Main processing function"""
+    def initialize_output_services(self):
+        """Initialize Drive and Sheets, which each make API calls on setup"""
+        if self.drive_service and self.sheets_service:
+            return
+        
+        try:
+            drive_api = self.auth_service.get_drive_service()
+            sheets_api = self.auth_service.get_sheets_service()
+            
+            self.drive_service = DriveService(drive_api, folder_name=self.account.drive_folder_name)
+            self.sheets_service = SheetsService(sheets_api, spreadsheet_id=self.account.spreadsheet_id)
+            
+        except Exception as e:
+            print(f"Failed to initialize output services: {e}")
+            raise
+    
+    def process_emails(self, query: Optional[str] = None):
+        """Main processing function; query overrides the usual target search
+        (used by backfill shards) and leaves the sync checkpoint alone"""
+        budget_token = use_account_budget(self.budget)
         try:
-            print("Starting email processing...")
+            print(f"Starting email processing for {self.account.name}...")
+            if self.owns_metrics:
+                metrics.reset()
             
             if not self.gmail_service:
                 self.initialize_services()
             
-            # Get target emails
-            email_ids = self.gmail_service.search_target_emails()
+            self._processed_count = 0
+            self._listed_count = 0
+            self._run_incomplete = False
             
-            if not email_ids:
-                print("No unread target emails found")
-                return
-            
-            processed_count = 0
+            # Stream target emails so fetching starts while later pages are listed
+            if query is None:
+                email_ids = self._open_email_source()
+            else:
+                self._filter_subject = False
+                email_ids = self.gmail_service.iter_target_emails(
+                    query=query, max_messages=self.max_messages
+                )
+            first_id = next(email_ids, None)
             
-            for email_id in email_ids:
+            if first_id is None:
+                print("No unread target emails found")
+            else:
+                email_ids = itertools.chain([first_id], email_ids)
+                self.initialize_output_services()
+                self.sheets_service.load_ledger_index()
+                self._sheet_writer = BufferedSheetWriter(
+                    self.sheets_service, on_commit=self._on_row_committed,
+                    max_rows=SHEETS_BATCH_ROWS,
+                    max_age_seconds=SHEETS_BATCH_MAX_AGE_SECONDS
+                )
                 try:
-                    processed_count += self._process_single_email(email_id)
-                except Exception as e:
-                    print(f"Error processing email {email_id}: {e}")
-                    continue
+                    self._build_pipeline().run(self._chunk(email_ids, GMAIL_FETCH_BATCH_SIZE))
+                finally:
+                    self._sheet_writer.close()
+                self._flush_processed_emails()
+                print(f"Processing complete. Processed {self._processed_count} attachments")
+                if self.extraction_service.cache:
+                    print(f"Extraction cache: {self.extraction_service.cache.stats()}")
             
-            print(f"Processing complete. Processed {processed_count} attachments")
+            if query is None:
+                self._save_sync_checkpoint()
             
         except Exception as e:
             print(f"Error in main processing: {e}")
+            self._run_incomplete = True
+        finally:
+            release_account_budget(budget_token)
+            if self.owns_metrics:
+                self._publish_metrics()
     
-    def _process_single_email(self, email_id: str) -> int:
-        processed_count = 0
-        
-        email_data = self.gmail_service.get_email_with_attachments(email_id)
-        
-        if not email_data or not email_data.get('attachments'):
-            return 0
+    def _publish_metrics(self):
+        """Write this run's metrics as a Prometheus text file and JSON summary"""
+        try:
+            metrics.set_gauge('run_processed_attachments', self._processed_count,
+                              help_text='Attachments fully processed in the last run')
+            cache = self.extraction_service.cache
+            if cache:
+                metrics.set_gauge('extraction_cache_hit_rate', cache.stats()['hit_rate'],
+                                  help_text='Extraction cache hit rate since process start')
+            if METRICS_TEXTFILE:
+                metrics.write_textfile(METRICS_TEXTFILE)
+            if METRICS_SUMMARY_DIR:
+                print(f"Run summary written to {metrics.write_summary(METRICS_SUMMARY_DIR)}")
+        except Exception as e:
+            print(f"Error writing metrics: {e}")
+    
+    def _open_email_source(self) -> Iterator[str]:
+        """Pick the message ID source for this run based on SYNC_MODE"""
+        self._next_history_id = None
+        self._filter_subject = False
         
-        for attachment in email_data['attachments']:
-            if self._process_attachment(email_id, attachment):
-                processed_count += 1
+        if not self.gmail_service.supports_history:
+            # A local archive: no live mailbox to share with a backfill
+            return self.gmail_service.iter_target_emails(max_messages=self.max_messages)
+        if SYNC_MODE != 'history':
+            return self.gmail_service.iter_target_emails(
+                query=self._live_query(self.gmail_service.unread_target_query()),
+                max_messages=self.max_messages
+            )
         
-        # Mark email as processed if we processed any attachments
-        if processed_count > 0:
-            self.gmail_service.mark_as_processed(email_id)
+        start_history_id = self.checkpoint.load()
+        if start_history_id:
+            email_ids = self.gmail_service.iter_new_message_ids(
+                start_history_id, max_messages=self.max_messages
+            )
+            try:
+                # History listing can't filter by subject, so check on fetch
+                self._filter_subject = True
+                return itertools.chain([next(email_ids)], email_ids)
+            except StopIteration:
+                return iter(())
+            except HistoryExpiredError:
+                print("Sync checkpoint expired, falling back to full search")
         
-        return processed_count
+        # Full search: record the historyId first so nothing added during
+        # the run is missed by the next incremental sync
+        self._filter_subject = False
+        self._next_history_id = self.gmail_service.get_history_id()
+        return self.gmail_service.iter_target_emails(
+            query=self._live_query(self.gmail_service.unprocessed_target_query()),
+            max_messages=self.max_messages
+        )
     
-    def _process_attachment(self, email_id: str, attachment: dict) -> bool:
-        """Process a single attachment"""
-        try:
-            # Check if file type is supported
-            if attachment['mimeType'] not in SUPPORTED_MIME_TYPES:
-                return False
-            
-            file_data = self.gmail_service.download_attachment(
-                email_id, attachment['attachmentId']
-            )
+    def _live_query(self, query: str) -> str:
+        """Leave mail in the range of an unfinished backfill to the backfill"""
+        window = live_search_window(self.account.backfill_state_file)
+        if not window:
+            return query
+        print(f"Backfill in progress; searching only {window}")
+        return f"{query} {window}"
+    
+    def _save_sync_checkpoint(self):
+        if SYNC_MODE != 'history' or not self.gmail_service.supports_history:
+            return
+        if self._run_incomplete:
+            # Leave the checkpoint so failed emails are listed again
+            print("Some emails were not processed; keeping sync checkpoint")
+            return
+        if self._next_history_id and self._listing_capped():
+            # The full search stopped at max_messages, so the historyId taken
+            # before it would skip the rest; search again next run
+            print("Search reached the message cap; keeping sync checkpoint")
+            return
+        history_id = self._next_history_id or self.gmail_service.latest_history_id
+        if history_id:
+            self.checkpoint.save(history_id)
+    
+    def _listing_capped(self) -> bool:
+        return self.max_messages is not None and self._listed_count >= self.max_messages
+    
+    def _build_pipeline(self) -> StagedPipeline:
+        handlers = [
+            ('fetch', self._fetch_stage),
+            ('download', self._download_stage),
+            ('extract', self._extract_stage),
+            ('upload', self._upload_stage),
+        ]
+        stages = [
+            Stage(name, handler, **PIPELINE_STAGES.get(name, {}))
+            for name, handler in handlers
+        ]
+        return StagedPipeline(stages, on_done=self._on_pipeline_done)
+    
+    @staticmethod
+    def _chunk(items, size: int):
+        """Group an iterable of email IDs into lists for batched fetching"""
+        chunk = []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    
+    def _fetch_stage(self, email_ids: List[str]) -> List[AttachmentJob]:
+        jobs = []
+        with self._pending_lock:
+            self._listed_count += len(email_ids)
+        emails = self.gmail_service.get_emails_with_attachments(email_ids)
+        if len(emails) < len(email_ids):
+            self._run_incomplete = True
+        
+        for email_data in emails:
+            if self._filter_subject and not self.gmail_service.is_target_subject(email_data['subject']):
+                continue
             
-            if not file_data:
-                return False
+            # Unsupported and oversized parts were already dropped by GmailService
+            attachments = email_data.get('attachments', [])
+            if not attachments:
+                continue
             
-            invoice_data = self.extraction_service.extract_invoice_data(
-                file_data, attachment['filename'], attachment['mimeType']
-            )
+            # Register before any job is handed downstream
+            with self._pending_lock:
+                self._pending[email_data['id']] = {
+                    'remaining': len(attachments), 'succeeded': 0
+                }
             
-            file_url = self.drive_service.upload_file(
-                file_data, attachment['filename'], 
-                attachment['mimeType'], invoice_data
+            for attachment in attachments:
+                job = AttachmentJob(email_data['id'], attachment)
+                entry = self.journal.get(job.key)
+                if entry:
+                    print(f"Resuming {job.filename} after stage '{entry['stage']}'")
+                    job.resume_from(entry)
+                jobs.append(job)
+        return jobs
+    
+    def _download_stage(self, job: AttachmentJob) -> Optional[AttachmentJob]:
+        if reached(job.resumed_stage, work_journal.UPLOADED):
+            return job
+        
+        job.file_data = self.gmail_service.download_attachment_handle(
+            job.email_id, job.attachment
+        )
+        if not job.file_data:
+            return None
+        self.journal.record(job.key, job.email_id, work_journal.DOWNLOADED)
+        return job
+    
+    def _extract_stage(self, job: AttachmentJob) -> AttachmentJob:
+        if reached(job.resumed_stage, work_journal.UPLOADED):
+            return job
+        
+        if not reached(job.resumed_stage, work_journal.EXTRACTED):
+            job.invoice_data = self.extraction_service.extract_invoice_data(
+                job.file_data, job.filename, job.mime_type
             )
-            
-            if not file_url:
-                return False
-            
-            success = self.sheets_service.log_processed_data(
-                invoice_data, file_url, attachment['mimeType']
+            self.journal.record(
+                job.key, job.email_id, work_journal.EXTRACTED, invoice_data=job.invoice_data
             )
-            
-            if success:
-                print(f"Successfully processed: {attachment['filename']}")
-                return True
-            else:
-                print(f"Failed to log data for: {attachment['filename']}")
-                return False
-                
-        except Exception as e:
-            print(f"Error processing attachment {attachment['filename']}: {e}")
-            return False
+        
+        job.duplicate = self.sheets_service.ledger.check_and_add(job.invoice_data)
+        if job.duplicate:
+            print(f"Duplicate invoice {job.invoice_data.get('invoice_number')} in {job.filename}")
+        return job
+    
+    def _upload_stage(self, job: AttachmentJob) -> Optional[AttachmentJob]:
+        if reached(job.resumed_stage, work_journal.UPLOADED):
+            return job
+        if job.duplicate and DUPLICATE_INVOICE_ACTION == 'skip':
+            job.release()
+            return job
+        
+        job.file_url = self.drive_service.upload_file(
+            job.file_data, job.filename, job.mime_type, job.invoice_data
+        )
+        # Release the attachment content as early as possible
+        job.release()
+        if not job.file_url:
+            return None
+        self.journal.record(job.key, job.email_id, work_journal.UPLOADED, file_url=job.file_url)
+        return job
+    
+    def _on_pipeline_done(self, item, ok: bool):
+        """Queue uploaded attachments for the sheet; anything else has failed"""
+        if not isinstance(item, AttachmentJob):
+            # A fetch batch that raised: its emails were never registered,
+            # so keep the sync checkpoint and list them again next run
+            if not ok:
+                with self._pending_lock:
+                    self._run_incomplete = True
+            return
+        item.release()
+        
+        if not ok:
+            self._on_attachment_done(item, False)
+            return
+        
+        if reached(item.resumed_stage, work_journal.LOGGED):
+            self._on_attachment_done(item, True)
+            return
+        
+        if item.duplicate and DUPLICATE_INVOICE_ACTION == 'skip':
+            # Already in the ledger, so there is nothing left to do
+            self.journal.record(item.key, item.email_id, work_journal.LOGGED)
+            self._on_attachment_done(item, True)
+            return
+        
+        note = 'Possible duplicate' if item.duplicate else ''
+        row = self.sheets_service.build_row(item.invoice_data, item.file_url, item.mime_type, note)
+        self._sheet_writer.add(row, item)
+    
+    def _on_row_committed(self, item: AttachmentJob, ok: bool):
+        if ok:
+            self.journal.record(item.key, item.email_id, work_journal.LOGGED)
+        self._on_attachment_done(item, ok)
+    
+    def _on_attachment_done(self, item: AttachmentJob, ok: bool):
+        """Track per-email completion and mark emails once all attachments
+        finish; ok means the attachment's sheet row was committed"""
+        if ok:
+            print(f"Successfully processed: {item.filename}")
+        else:
+            print(f"Failed to process: {item.filename}")
+            if not item.duplicate:
+                self.sheets_service.ledger.discard(item.invoice_data)
+        
+        with self._pending_lock:
+            state = self._pending[item.email_id]
+            state['remaining'] -= 1
+            if ok:
+                state['succeeded'] += 1
+                self._processed_count += 1
+            finished = state['remaining'] == 0
+            if finished:
+                del self._pending[item.email_id]
+                if state['succeeded'] == 0:
+                    self._run_incomplete = True
+        
+        # Mark email as processed if we processed any attachments
+        if finished and state['succeeded'] > 0:
+            if GMAIL_MARK_BATCH_SIZE <= 0:
+                if self.gmail_service.mark_as_processed(item.email_id):
+                    self.journal.forget_emails([item.email_id])
+                else:
+                    self._mark_failed()
+                return
+            with self._pending_lock:
+                self._processed_emails.append(item.email_id)
+                flush = len(self._processed_emails) >= GMAIL_MARK_BATCH_SIZE
+            if flush:
+                self._flush_processed_emails()
+    
+    def _flush_processed_emails(self):
+        with self._pending_lock:
+            email_ids, self._processed_emails = self._processed_emails, []
+        if email_ids:
+            # Keep journal entries for emails left unmarked: the next run
+            # lists them again and resumes instead of redoing them
+            marked = self.gmail_service.mark_many_as_processed(email_ids)
+            self.journal.forget_emails(marked)
+            if len(marked) < len(email_ids):
+                self._mark_failed()
+    
+    def _mark_failed(self):
+        with self._pending_lock:
+            self._run_incomplete = True
 
 def run_once():
     """Run the processor once"""
     processor = InvoiceProcessor()
     processor.process_emails()
 
+def run_ingest(path: str, match_subject: bool = True):
+    """Process an mbox file or .eml directory through the normal pipeline"""
+    processor = InvoiceProcessor()
+    processor.gmail_service = LocalMailboxService(path, match_subject=match_subject)
+    processor.process_emails()
+
 def run_scheduled():
     """Run with scheduler"""
     processor = InvoiceProcessor()
@@ -158,5 +498,27 @@ def run_scheduled():
         time.sleep(60)  # Check every minute
 
 if __name__ == "__main__":
-    #run_once()
-    run_scheduled()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Gmail invoice processing automation")
+    parser.add_argument('--once', action='store_true',
+                        help="process waiting mail once and exit (for cron/serverless)")
+    parser.add_argument('--ingest', metavar='PATH',
+                        help="process an mbox file or directory of .eml files instead of Gmail, then exit")
+    parser.add_argument('--all-subjects', action='store_true',
+                        help="with --ingest, process every archived email, not just target subjects")
+    parser.add_argument('--import-report', action='store_true',
+                        help="print how long module imports took before exiting")
+    args = parser.parse_args()
+    
+    if METRICS_HTTP_PORT:
+        metrics.serve(METRICS_HTTP_PORT)
+    
+    try:
+        if args.ingest:
+            run_ingest(args.ingest, match_subject=not args.all_subjects)
+        elif args.once:
+            run_once()
+        else:
+            run_scheduled()
+    finally:
+        if args.import_report:
+            print(import_report(total=time.perf_counter() - _STARTED))
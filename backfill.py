@@ -0,0 +1,233 @@
+"""
+Parallel historical backfill: processes a date range as Gmail query shards
+spread across worker processes
+"""
+import argparse
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from config import (
+    BACKFILL_WORKERS, BACKFILL_SHARD_DAYS, BACKFILL_API_CALLS_PER_MINUTE,
+    BACKFILL_STATE_FILE, CPU_POOL_WORKERS, SCHEDULE_HOURS
+)
+
+Shard = Tuple[date, date]  # [after, before)
+
+DONE = 'done'
+
+
+def make_shards(since: date, until: date, days: int) -> List[Shard]:
+    """Split [since, until) into consecutive windows of at most days days"""
+    shards = []
+    start = since
+    while start < until:
+        end = min(start + timedelta(days=max(1, days)), until)
+        shards.append((start, end))
+        start = end
+    return shards
+
+
+def default_until() -> date:
+    """First day the scheduled job may still be working on (UTC, like the
+    shard windows), so by default the live search is not held back at all"""
+    live_since = datetime.now(timezone.utc) - timedelta(hours=SCHEDULE_HOURS)
+    return live_since.date()
+
+
+def shard_key(shard: Shard) -> str:
+    return f"{shard[0].isoformat()}..{shard[1].isoformat()}"
+
+
+def _epoch(day: date) -> int:
+    return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+
+
+def shard_window(shard: Shard) -> str:
+    """Gmail query terms for the shard, as epoch seconds so the windows
+    are exact and adjacent regardless of mailbox timezone"""
+    return f"after:{_epoch(shard[0])} before:{_epoch(shard[1])}"
+
+
+def live_search_window(path: str) -> str:
+    """Query term that keeps the scheduled job's search after the range of
+    an unfinished backfill recorded at path, or '' when there is none.
+
+    Both would otherwise list the same old unread emails and process them
+    twice.
+    """
+    state = BackfillState(path)
+    if state.complete or state.until is None:
+        return ''
+    return f"after:{_epoch(state.until)}"
+
+
+class BackfillState:
+    """JSON file recording the outcome of each shard, so an interrupted
+    backfill only re-runs shards that did not finish"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.until: Optional[date] = None
+        self.complete = True
+        self.shards: Dict[str, Dict] = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (ValueError, OSError) as e:
+            print(f"Ignoring unreadable backfill state: {e}")
+            return
+        self.shards = data.get('shards', {})
+        self.until = date.fromisoformat(data['until']) if data.get('until') else None
+        self.complete = data.get('complete', True)
+
+    def begin(self, until: date):
+        """Mark a backfill up to until as running; the scheduled job keeps
+        its search after until until finish() records completion"""
+        self.until = until
+        self.complete = False
+        self._save()
+
+    def finish(self, complete: bool):
+        self.complete = complete
+        self._save()
+
+    def is_done(self, shard: Shard) -> bool:
+        return self.shards.get(shard_key(shard), {}).get('status') == DONE
+
+    def record(self, shard: Shard, status: str, processed: int = 0):
+        self.shards[shard_key(shard)] = {
+            'status': status,
+            'processed': processed,
+            'updated_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        self._save()
+
+    def _save(self):
+        data = {
+            'until': self.until.isoformat() if self.until else None,
+            'complete': self.complete,
+            'shards': self.shards,
+        }
+        # Write then rename so a crash never leaves a truncated file
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+# Worker process state: one processor (and set of API clients) per process
+_processor = None
+
+
+def _init_worker(calls_per_minute: float):
+    from services.rate_limit import set_api_budget
+    set_api_budget(calls_per_minute)
+
+
+def _process_shard(shard: Shard) -> Dict:
+    global _processor
+    from app import InvoiceProcessor
+
+    if _processor is None:
+        _processor = InvoiceProcessor()
+        _processor.initialize_services()
+
+    query = f"{_processor.gmail_service.unprocessed_target_query()} {shard_window(shard)}"
+    print(f"Backfilling {shard_key(shard)}")
+    _processor.process_emails(query=query)
+    return {
+        'processed': _processor._processed_count,
+        'complete': not _processor._run_incomplete,
+    }
+
+
+def run_backfill(since: date, until: date, shard_days: int = BACKFILL_SHARD_DAYS,
+                 workers: int = BACKFILL_WORKERS,
+                 calls_per_minute: int = BACKFILL_API_CALLS_PER_MINUTE,
+                 state_path: str = BACKFILL_STATE_FILE) -> bool:
+    """Process every unfinished shard; returns True once all are done"""
+    shards = make_shards(since, until, shard_days)
+    state = BackfillState(state_path)
+    pending = [shard for shard in shards if not state.is_done(shard)]
+    print(f"Backfill {since} to {until}: {len(shards)} shards, {len(pending)} to process")
+    if not pending:
+        state.finish(True)
+        return True
+    # Hold the scheduled job's search back to mail after until from now on
+    state.begin(until)
+
+    # Refresh the token once here so workers don't race to rewrite token.json
+    from services.auth_service import AuthService
+    AuthService().authenticate()
+
+    workers = max(1, min(workers, len(pending)))
+    # Workers share the CPU instead of each starting a full-size CPU pool;
+    # spawned processes read this when they import config
+    os.environ.setdefault('CPU_POOL_WORKERS', str(max(1, CPU_POOL_WORKERS // workers)))
+    # Each worker gets a fixed, even share; a share left idle is not lent
+    # to the other workers
+    per_worker_budget = calls_per_minute / workers if calls_per_minute > 0 else 0
+
+    total_processed = 0
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(per_worker_budget,)
+    ) as pool:
+        futures = {pool.submit(_process_shard, shard): shard for shard in pending}
+        for future in as_completed(futures):
+            shard = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Shard {shard_key(shard)} failed: {e}")
+                state.record(shard, 'failed')
+                continue
+            status = DONE if result['complete'] else 'incomplete'
+            state.record(shard, status, result['processed'])
+            total_processed += result['processed']
+            print(f"Shard {shard_key(shard)} {status}: {result['processed']} attachments")
+
+    remaining = sum(1 for shard in shards if not state.is_done(shard))
+    print(f"Backfill processed {total_processed} attachments; {remaining} shards left to retry")
+    state.finish(remaining == 0)
+    return remaining == 0
+
+
+def _parse_date(value: str) -> date:
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Backfill historical invoice emails in parallel")
+    parser.add_argument('--since', type=_parse_date, required=True, help="first day, YYYY-MM-DD")
+    parser.add_argument('--until', type=_parse_date, default=default_until(),
+                        help="day after the last day, YYYY-MM-DD (default: the first day "
+                             "the scheduled job may still be processing)")
+    parser.add_argument('--shard-days', type=int, default=BACKFILL_SHARD_DAYS)
+    parser.add_argument('--workers', type=int, default=BACKFILL_WORKERS)
+    parser.add_argument('--calls-per-minute', type=int, default=BACKFILL_API_CALLS_PER_MINUTE,
+                        help="Google API calls per minute, split evenly between the "
+                             "workers (0 for no cap)")
+    parser.add_argument('--state-file', default=BACKFILL_STATE_FILE)
+    args = parser.parse_args(argv)
+
+    complete = run_backfill(
+        args.since, args.until, shard_days=args.shard_days, workers=args.workers,
+        calls_per_minute=args.calls_per_minute, state_path=args.state_file
+    )
+    return 0 if complete else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
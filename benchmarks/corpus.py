@@ -0,0 +1,107 @@
+"""
+Synthetic invoice corpus: text-layer PDFs, images and .eml files
+"""
+import io
+import random
+from email.message import EmailMessage
+from typing import List, Tuple
+
+VENDORS = ['Acme Supplies Ltd', 'Globex Corporation', 'Initech LLC', 'Umbrella Co', 'Stark Industries Inc']
+
+Attachment = Tuple[str, str, bytes]  # filename, MIME type, content
+
+
+def invoice_lines(rng: random.Random, index: int) -> List[str]:
+    vendor = rng.choice(VENDORS)
+    amount = rng.randint(1000, 500000) / 100
+    return [
+        vendor,
+        '123 Business Road, Springfield',
+        f'Invoice No: INV-{20000 + index}',
+        f'Invoice Date: {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2024',
+        'Description                Qty      Price',
+        f'Consulting services        {rng.randint(1, 20)}        {amount / 2:.2f}',
+        f'Subtotal: ${amount * 0.9:,.2f}',
+        f'Total: ${amount:,.2f}',
+    ]
+
+
+def make_text_pdf(lines: List[str]) -> bytes:
+    """Minimal single-page PDF with a real text layer"""
+    def escape(text):
+        return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+    stream = 'BT /F1 11 Tf 72 740 Td 16 TL ' + ' '.join(f"({escape(line)}) '" for line in lines) + ' ET'
+    objects = [
+        '<< /Type /Catalog /Pages 2 0 R >>',
+        '<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+        '/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>',
+        '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+        f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream',
+    ]
+
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f'{number} 0 obj\n{body}\nendobj\n'.encode('latin-1'))
+    xref = out.tell()
+    out.write(f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('latin-1'))
+    for offset in offsets:
+        out.write(f'{offset:010d} 00000 n \n'.encode('latin-1'))
+    out.write(
+        f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode('latin-1')
+    )
+    return out.getvalue()
+
+
+def make_image(lines: List[str], rng: random.Random) -> bytes:
+    """Phone-photo sized JPEG with the invoice drawn on it (requires Pillow)"""
+    from PIL import Image, ImageDraw
+
+    img = Image.new('RGB', (3000, 4000), (250, 250, 245))
+    draw = ImageDraw.Draw(img)
+    for row, line in enumerate(lines):
+        draw.text((200, 300 + row * 120), line, fill=(20, 20, 20))
+    # Sensor-like noise so the JPEG does not compress unrealistically well
+    for _ in range(20000):
+        draw.point((rng.randrange(3000), rng.randrange(4000)), fill=(rng.randrange(256),) * 3)
+
+    out = io.BytesIO()
+    img.save(out, format='JPEG', quality=92)
+    return out.getvalue()
+
+
+def make_eml(lines: List[str]) -> bytes:
+    msg = EmailMessage()
+    msg['From'] = f'"{lines[0]}" <billing@example.com>'
+    msg['To'] = 'accounts@example.com'
+    msg['Subject'] = f'Invoice {lines[2]}'
+    msg.set_content('\n'.join(lines))
+    return bytes(msg)
+
+
+def build_corpus(count: int, seed: int = 0, include_images: bool = True) -> List[Attachment]:
+    """count attachments cycling through PDF, .eml and (if Pillow is present) JPEG"""
+    rng = random.Random(seed)
+    kinds = ['pdf', 'eml']
+    if include_images:
+        try:
+            import PIL  # noqa: F401
+            kinds.append('image')
+        except ImportError:
+            print("Pillow not installed; corpus will not include images")
+
+    corpus = []
+    for index in range(count):
+        lines = invoice_lines(rng, index)
+        kind = kinds[index % len(kinds)]
+        if kind == 'pdf':
+            corpus.append((f'invoice_{index}.pdf', 'application/pdf', make_text_pdf(lines)))
+        elif kind == 'eml':
+            corpus.append((f'invoice_{index}.eml', 'message/rfc822', make_eml(lines)))
+        else:
+            corpus.append((f'invoice_{index}.jpg', 'image/jpeg', make_image(lines, rng)))
+    return corpus
@@ -0,0 +1,306 @@
+"""
+In-memory Gmail, Drive and Sheets backends behind an httplib2-compatible
+transport, in the spirit of googleapiclient.http.HttpMockSequence.
+
+Real discovery-built clients are pointed at FakeGoogleHttp, so request
+building, batch encoding, resumable uploads and response parsing all run
+exactly as they do against Google.
+"""
+import base64
+import email.parser
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import httplib2
+
+from config import TARGET_SUBJECT
+from services.auth_service import AuthService
+
+Attachment = Tuple[str, str, bytes]  # filename, MIME type, content
+
+
+class FakeGoogleHttp:
+    """Routes Gmail/Drive/Sheets REST calls to in-memory state.
+
+    latency is added to every HTTP round trip (a batch counts as one) and
+    error_rate makes that share of non-batch requests fail with a 503.
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.labels = [{'id': 'INBOX', 'name': 'INBOX'}, {'id': 'UNREAD', 'name': 'UNREAD'}]
+        self.messages = {}
+        self.attachments = {}
+        self.history_id = 1000
+        self.drive_files = {}
+        self._uploads = {}
+        self.sheet_rows = []
+
+    # Mailbox setup
+
+    def add_message(self, attachments: List[Attachment], subject: str = None) -> str:
+        with self._lock:
+            message_id = f'msg{len(self.messages):06d}'
+            parts = [{
+                'partId': '0', 'mimeType': 'text/plain', 'filename': '',
+                'body': {'size': 14, 'data': _b64(b'Please see attached')},
+            }]
+            for index, (filename, mime_type, content) in enumerate(attachments, start=1):
+                attachment_id = f'att-{message_id}-{index}'
+                self.attachments[attachment_id] = content
+                parts.append({
+                    'partId': str(index), 'mimeType': mime_type, 'filename': filename,
+                    'body': {'attachmentId': attachment_id, 'size': len(content)},
+                })
+            self.messages[message_id] = {
+                'id': message_id,
+                'threadId': message_id,
+                'labelIds': ['INBOX', 'UNREAD'],
+                'payload': {
+                    'partId': '', 'mimeType': 'multipart/mixed', 'filename': '',
+                    'headers': [{'name': 'Subject', 'value': subject or f'{TARGET_SUBJECT} {message_id}'}],
+                    'body': {'size': 0},
+                    'parts': parts,
+                },
+            }
+            self.history_id += 1
+            return message_id
+
+    # httplib2.Http interface
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=5, connection_type=None):
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            fail = self._rng.random() < self.error_rate
+        time.sleep(delay)
+
+        # Resumable upload chunks arrive as file-like slices of the media
+        if hasattr(body, 'read'):
+            body = body.read()
+
+        path = urlsplit(uri).path
+        if path == '/batch' or path.startswith('/batch/'):
+            return self._batch(body, headers)
+        if fail:
+            return self._response(503, {'error': {'code': 503, 'message': 'Backend error'}})
+        return self._route(method, uri, body, headers)
+
+    def close(self):
+        pass
+
+    # Routing
+
+    def _route(self, method, uri, body, headers):
+        parts = urlsplit(uri)
+        path = unquote(parts.path)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        payload = _json_body(body)
+
+        with self._lock:
+            if path.startswith('/gmail/v1/users/me/'):
+                return self._gmail(method, path[len('/gmail/v1/users/me/'):], query, payload)
+            if path.startswith('/upload/drive/v3/files'):
+                return self._drive_upload(method, query, body, headers)
+            if path.startswith('/drive/v3/files'):
+                return self._drive(method, query, payload)
+            match = re.match(r'/v4/spreadsheets/[^/]+/values/(.+)$', path)
+            if match:
+                return self._sheets(method, match.group(1), payload)
+        return self._response(404, {'error': {'code': 404, 'message': f'No fake for {method} {path}'}})
+
+    def _gmail(self, method, path, query, payload):
+        if path == 'labels':
+            if method == 'POST':
+                label = {'id': f'Label_{len(self.labels)}', 'name': payload['name']}
+                self.labels.append(label)
+                return self._response(200, label)
+            return self._response(200, {'labels': self.labels})
+
+        if path == 'profile':
+            return self._response(200, {'emailAddress': 'bench@example.com', 'historyId': str(self.history_id)})
+
+        if path == 'messages' and method == 'GET':
+            unread = sorted(
+                message_id for message_id, message in self.messages.items()
+                if 'UNREAD' in message['labelIds']
+            )
+            start = int(query.get('pageToken') or 0)
+            size = int(query.get('maxResults') or 100)
+            page = unread[start:start + size]
+            result = {'messages': [{'id': message_id, 'threadId': message_id} for message_id in page]}
+            if start + size < len(unread):
+                result['nextPageToken'] = str(start + size)
+            return self._response(200, result)
+
+        if path == 'messages/batchModify':
+            for message_id in payload.get('ids', []):
+                self._modify(message_id, payload)
+            return self._response(204, None)
+
+        match = re.match(r'messages/([^/]+)/attachments/([^/]+)$', path)
+        if match:
+            content = self.attachments.get(match.group(2))
+            if content is None:
+                return self._response(404, {'error': {'code': 404, 'message': 'Attachment not found'}})
+            return self._response(200, {'size': len(content), 'data': _b64(content)})
+
+        match = re.match(r'messages/([^/]+)/modify$', path)
+        if match:
+            message = self._modify(match.group(1), payload)
+            return self._response(200, {'id': message['id'], 'labelIds': message['labelIds']})
+
+        match = re.match(r'messages/([^/]+)$', path)
+        if match and match.group(1) in self.messages:
+            return self._response(200, self.messages[match.group(1)])
+
+        return self._response(404, {'error': {'code': 404, 'message': f'No fake for gmail {path}'}})
+
+    def _modify(self, message_id, changes):
+        message = self.messages[message_id]
+        labels = [label for label in message['labelIds'] if label not in changes.get('removeLabelIds', [])]
+        labels += [label for label in changes.get('addLabelIds', []) if label not in labels]
+        message['labelIds'] = labels
+        self.history_id += 1
+        return message
+
+    def _drive(self, method, query, payload):
+        if method == 'POST':
+            return self._response(200, self._create_file(payload, b''))
+
+        q = query.get('q', '')
+        match = re.search(r"value='([0-9a-f]+)'", q)
+        if match:
+            files = [
+                f for f in self.drive_files.values()
+                if f.get('appProperties', {}).get('contentSha256') == match.group(1)
+            ]
+        else:
+            match = re.search(r"name='([^']*)'", q)
+            name = match.group(1) if match else None
+            files = [f for f in self.drive_files.values() if name is None or f['name'] == name]
+        return self._response(200, {'files': files[:int(query.get('pageSize') or 100)]})
+
+    def _drive_upload(self, method, query, body, headers):
+        upload_id = query.get('upload_id')
+        if upload_id is None:
+            # Start a resumable session
+            upload_id = uuid.uuid4().hex
+            self._uploads[upload_id] = {'metadata': _json_body(body), 'data': b''}
+            location = f'https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable&upload_id={upload_id}'
+            return self._response(200, {}, {'location': location})
+
+        upload = self._uploads[upload_id]
+        upload['data'] += body if isinstance(body, bytes) else (body or '').encode()
+        match = re.match(r'bytes \d+-(\d+)/(\d+)', headers.get('content-range', ''))
+        if match and int(match.group(1)) + 1 < int(match.group(2)):
+            return self._response(308, None, {'range': f'bytes=0-{match.group(1)}'})
+
+        del self._uploads[upload_id]
+        return self._response(200, self._create_file(upload['metadata'], upload['data']))
+
+    def _create_file(self, metadata, data):
+        file_id = f'file{len(self.drive_files):06d}'
+        record = dict(metadata or {}, id=file_id, size=len(data),
+                      webViewLink=f'https://drive.example.com/file/d/{file_id}/view')
+        self.drive_files[file_id] = record
+        return record
+
+    def _sheets(self, method, target, payload):
+        if target.endswith(':append'):
+            rows = payload.get('values', [])
+            self.sheet_rows.extend(rows)
+            return self._response(200, {'updates': {'updatedRows': len(rows)}})
+        if method == 'PUT':
+            return self._response(200, {'updatedRows': len(payload.get('values', []))})
+        if target.startswith('A1:'):
+            return self._response(200, {'range': target})
+        return self._response(200, {'range': target, 'values': self.sheet_rows})
+
+    # Batch HTTP
+
+    def _batch(self, body, headers):
+        """Decode a multipart/mixed batch, route each inner request and
+        encode the answers the way Google's batch endpoint does"""
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        request = email.parser.Parser().parsestr(
+            f"Content-Type: {headers['content-type']}\r\n\r\n{body}"
+        )
+
+        boundary = f'batch_{uuid.uuid4().hex}'
+        chunks = []
+        for part in request.get_payload():
+            request_line, _, rest = part.get_payload().partition('\n')
+            method, path, _ = request_line.split(' ', 2)
+            inner_body = re.split(r'\r?\n\r?\n', rest, maxsplit=1)[-1].strip() if method != 'GET' else ''
+            resp, content = self._route(method, 'https://www.googleapis.com' + path, inner_body or None, {})
+            status = resp.status
+            chunks.append(
+                f'--{boundary}\r\n'
+                f'Content-Type: application/http\r\n'
+                f'Content-ID: <response-{part["Content-ID"][1:]}\r\n\r\n'
+                f'HTTP/1.1 {status} {"OK" if status < 300 else "Error"}\r\n'
+                f'Content-Type: application/json\r\n\r\n'
+                f'{content.decode("utf-8")}\r\n'
+            )
+        chunks.append(f'--{boundary}--')
+        return self._response(200, ''.join(chunks).encode('utf-8'), {
+            'content-type': f'multipart/mixed; boundary={boundary}'
+        })
+
+    @staticmethod
+    def _response(status: int, payload, extra_headers: Dict = None):
+        info = {'status': str(status), 'content-type': 'application/json; charset=UTF-8'}
+        info.update(extra_headers or {})
+        if isinstance(payload, bytes):
+            content = payload
+        else:
+            content = b'' if payload is None else json.dumps(payload).encode('utf-8')
+        resp = httplib2.Response(info)
+        resp.reason = 'OK' if status < 300 else 'Error'
+        return resp, content
+
+
+class FakeAuthService(AuthService):
+    """AuthService whose clients talk to a FakeGoogleHttp instead of Google"""
+
+    def __init__(self, http: FakeGoogleHttp):
+        super().__init__()
+        self._http = http
+
+    def authenticate(self):
+        self.credentials = object()
+        return self.credentials
+
+    def _get_http(self):
+        return self._http
+
+
+def _b64(content: bytes) -> str:
+    return base64.urlsafe_b64encode(content).decode('ascii')
+
+
+def _json_body(body):
+    if not body:
+        return {}
+    try:
+        # Upload chunks are raw media, not JSON
+        return json.loads(body.decode('utf-8') if isinstance(body, bytes) else body)
+    except ValueError:
+        return {}
@@ -0,0 +1,68 @@
+"""
+Fake Groq client with configurable latency and error rate
+"""
+import json
+import random
+import threading
+import time
+
+
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+    class response:
+        headers = {'retry-after': '0.05'}
+
+
+class _Usage:
+    def __init__(self, total_tokens):
+        self.total_tokens = total_tokens
+
+
+class _Message:
+    def __init__(self, content):
+        self.content = content
+
+
+class _Choice:
+    def __init__(self, content):
+        self.message = _Message(content)
+
+
+class _Response:
+    def __init__(self, content, total_tokens):
+        self.choices = [_Choice(content)]
+        self.usage = _Usage(total_tokens)
+
+
+class FakeGroq:
+    """Stands in for groq.Groq: chat.completions.create sleeps for the
+    configured latency and fails with a 429 at error_rate."""
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.2,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.chat = self
+        self.completions = self
+
+    def create(self, messages, **kwargs):
+        with self._lock:
+            self.calls += 1
+            fail = self._rng.random() < self.error_rate
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+        time.sleep(delay)
+        if fail:
+            raise FakeRateLimitError("rate limited")
+
+        content = json.dumps({
+            'vendor_name': 'Fake Vendor Ltd',
+            'invoice_date': '01/01/2024',
+            'total_amount': '100.00 USD',
+            'invoice_number': f'FAKE-{self.calls}',
+        })
+        return _Response(content, total_tokens=1200)
@@ -0,0 +1,169 @@
+"""
+Offline end-to-end benchmark: drives InvoiceProcessor against fake Google
+and Groq backends and reports throughput, per-stage latency and peak RSS.
+
+    python -m benchmarks.run_benchmark --invoices 300 --json bench.json
+
+Exits non-zero when a --min-throughput or --max-rss-mb threshold is
+missed, so it can gate CI.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import app
+from config import (
+    GROQ_REQUESTS_PER_MINUTE, GROQ_TOKENS_PER_MINUTE, GROQ_MAX_IN_FLIGHT,
+    GROQ_MAX_RETRIES, GROQ_BACKOFF_BASE, GROQ_BACKOFF_MAX, PIPELINE_STAGES
+)
+from services import invoice_extractor
+from services.accounts import Account
+from services.cpu_pool import shutdown_cpu_pool
+from services.extraction_cache import ExtractionCache
+from services.llm_client import RateLimitedLLMClient
+from services.metrics import metrics
+from benchmarks.corpus import build_corpus
+from benchmarks.fake_google import FakeGoogleHttp, FakeAuthService
+from benchmarks.fake_groq import FakeGroq
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--invoices', type=int, default=200, help='Number of synthetic attachments')
+    parser.add_argument('--attachments-per-email', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-images', action='store_true', help='Only PDFs and .eml files')
+    parser.add_argument('--cache', action='store_true', help='Enable the extraction cache')
+    parser.add_argument('--google-latency', type=float, default=0.05, help='Seconds per Google round trip')
+    parser.add_argument('--google-error-rate', type=float, default=0.0)
+    parser.add_argument('--groq-latency', type=float, default=0.8, help='Seconds per Groq request')
+    parser.add_argument('--groq-error-rate', type=float, default=0.02)
+    parser.add_argument('--groq-rpm', type=int, default=GROQ_REQUESTS_PER_MINUTE)
+    parser.add_argument('--groq-tpm', type=int, default=GROQ_TOKENS_PER_MINUTE)
+    parser.add_argument('--json', dest='json_path', help='Write the report as JSON to this path')
+    parser.add_argument('--min-throughput', type=float, help='Fail below this many invoices/sec')
+    parser.add_argument('--max-rss-mb', type=float, help='Fail above this peak RSS (parent + workers)')
+    return parser.parse_args(argv)
+
+
+def peak_rss_mb() -> dict:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return {'process': round(own, 1), 'largest_worker': round(children, 1)}
+
+
+def run(args) -> dict:
+    corpus = build_corpus(args.invoices, seed=args.seed, include_images=not args.no_images)
+
+    http = FakeGoogleHttp(latency=args.google_latency, error_rate=args.google_error_rate, seed=args.seed)
+    per_email = max(1, args.attachments_per_email)
+    for start in range(0, len(corpus), per_email):
+        http.add_message(corpus[start:start + per_email])
+
+    groq = FakeGroq(latency=args.groq_latency, error_rate=args.groq_error_rate, seed=args.seed)
+    invoice_extractor._client = RateLimitedLLMClient(
+        groq,
+        requests_per_minute=args.groq_rpm,
+        tokens_per_minute=args.groq_tpm,
+        max_in_flight=GROQ_MAX_IN_FLIGHT,
+        max_retries=GROQ_MAX_RETRIES,
+        backoff_base=GROQ_BACKOFF_BASE,
+        backoff_max=GROQ_BACKOFF_MAX,
+    )
+
+    # Keep the benchmark from touching the real run summaries, metrics file
+    # and extraction cache; everything it writes stays in workdir
+    app.METRICS_SUMMARY_DIR = None
+    app.METRICS_TEXTFILE = None
+    invoice_extractor.EXTRACTION_CACHE_ENABLED = False
+
+    with tempfile.TemporaryDirectory(prefix='invoice-bench-') as workdir:
+        account = Account(
+            'benchmark', spreadsheet_id='benchmark-sheet',
+            work_journal_path=os.path.join(workdir, 'journal.db'),
+            sync_checkpoint_file=os.path.join(workdir, 'checkpoint.json'),
+            backfill_state_file=os.path.join(workdir, 'backfill_state.json')
+        )
+        processor = app.InvoiceProcessor(account)
+        processor.auth_service = FakeAuthService(http)
+        processor.extraction_service.cache = (
+            ExtractionCache(os.path.join(workdir, 'cache.db')) if args.cache else None
+        )
+
+        started = time.perf_counter()
+        processor.process_emails()
+        elapsed = time.perf_counter() - started
+        summary = metrics.summary()
+        processed = processor._processed_count
+        shutdown_cpu_pool()
+
+    unread = sum(1 for message in http.messages.values() if 'UNREAD' in message['labelIds'])
+    stages = {}
+    for name, timing in summary['timings'].items():
+        if name.startswith('stage_seconds[stage='):
+            stages[name[len('stage_seconds[stage='):-1]] = {
+                'count': timing['count'],
+                'p50_ms': round(timing['p50'] * 1000, 1),
+                'p99_ms': round(timing['p99'] * 1000, 1),
+            }
+
+    return {
+        'config': {**vars(args), 'pipeline_stages': PIPELINE_STAGES},
+        'attachments': len(corpus),
+        'processed': processed,
+        'elapsed_seconds': round(elapsed, 2),
+        'invoices_per_second': round(processed / elapsed, 2) if elapsed else 0.0,
+        'stages': stages,
+        'peak_rss_mb': peak_rss_mb(),
+        'backend': {
+            'google_requests': http.requests,
+            'groq_requests': groq.calls,
+            'drive_files': len(http.drive_files),
+            'sheet_rows': len(http.sheet_rows),
+            'unread_left': unread,
+        },
+        'metrics': summary,
+    }
+
+
+def print_report(report: dict):
+    print()
+    print(f"Processed {report['processed']}/{report['attachments']} attachments "
+          f"in {report['elapsed_seconds']}s ({report['invoices_per_second']} invoices/sec)")
+    print(f"{'stage':<10}{'items':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, stage in report['stages'].items():
+        print(f"{name:<10}{stage['count']:>8}{stage['p50_ms']:>10}{stage['p99_ms']:>10}")
+    rss = report['peak_rss_mb']
+    print(f"Peak RSS: {rss['process']} MB (largest CPU worker {rss['largest_worker']} MB)")
+    print(f"Backend: {report['backend']}")
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = run(args)
+    print_report(report)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"Report written to {args.json_path}")
+
+    failures = []
+    if args.min_throughput is not None and report['invoices_per_second'] < args.min_throughput:
+        failures.append(f"throughput {report['invoices_per_second']} < {args.min_throughput} invoices/sec")
+    rss = report['peak_rss_mb']
+    if args.max_rss_mb is not None and max(rss.values()) > args.max_rss_mb:
+        failures.append(f"peak RSS {max(rss.values())} MB > {args.max_rss_mb} MB")
+    for failure in failures:
+        print(f"Benchmark regression: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
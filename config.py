@@ -12,6 +12,13 @@ SCOPES: List[str] = [
     'https://www.googleapis.com/auth/spreadsheets'
 ]
 
+# Shared HTTP connection pool for Gmail, Drive and Sheets clients
+HTTP_POOL_SIZE = 20
+HTTP_TIMEOUT = 60  # seconds
+# Per-process cap on Gmail, Drive and Sheets calls per minute (0 for no cap);
+# batched messages.get counts one call per message
+GOOGLE_API_CALLS_PER_MINUTE = int(os.getenv("GOOGLE_API_CALLS_PER_MINUTE", "0"))
+
 # File paths
 CREDENTIALS_FILE = "credentials.json"
 TOKEN_FILE = "token.json"
@@ -24,10 +31,98 @@ DRIVE_FOLDER_NAME = os.getenv("DRIVE_FOLDER_NAME", "Viable Test Documents")
 TARGET_SUBJECT = "Viable: Trial Document"
 GMAIL_LABEL_NAME = "Processed"
 
+# Search pagination: results per messages.list page and an optional cap on
+# messages handled per run (None for no limit)
+GMAIL_PAGE_SIZE = 100
+GMAIL_MAX_MESSAGES = None
+
+# Sync mode: "search" runs a full unread search each time, "history" lists
+# only messages added since the last checkpointed historyId
+SYNC_MODE = os.getenv("SYNC_MODE", "search")
+SYNC_CHECKPOINT_FILE = "sync_checkpoint.json"
+
+# Messages fetched per Gmail batch HTTP request (Gmail recommends <= 50)
+GMAIL_FETCH_BATCH_SIZE = 50
+# Messages whose batch sub-request hit a 429/5xx are re-batched up to this
+# many times, with jittered exponential backoff
+GMAIL_BATCH_MAX_RETRIES = 3
+GMAIL_BATCH_BACKOFF_BASE = 1.0  # seconds
+GMAIL_BATCH_BACKOFF_MAX = 30.0  # seconds
+# Processed emails are marked with one batchModify per this many emails.
+# 0 marks each email as soon as its attachments are done.
+GMAIL_MARK_BATCH_SIZE = 500
+
 #Groq API Key
 GROQ_API_KEY = os.getenv("GROQ_API_KEY", "")
+LLM_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+# Groq quota and retry settings
+GROQ_REQUESTS_PER_MINUTE = int(os.getenv("GROQ_REQUESTS_PER_MINUTE", "30"))
+GROQ_TOKENS_PER_MINUTE = int(os.getenv("GROQ_TOKENS_PER_MINUTE", "30000"))
+GROQ_MAX_IN_FLIGHT = 4
+GROQ_MAX_RETRIES = 5
+GROQ_BACKOFF_BASE = 1.0  # seconds
+GROQ_BACKOFF_MAX = 60.0  # seconds
+# Bump whenever the extraction prompt changes so cached results are not reused
+PROMPT_VERSION = "4"
+
+# PDF text-layer fast path: pages with fewer characters are treated as
+# scanned, and the text layer is only trusted when this fraction of invoice
+# field signals (number, date, total) is present
+PDF_TEXT_MIN_CHARS = 50
+PDF_TEXT_MIN_SCORE = 0.67
+
+# PDF rasterization: pages are rendered PDF_RASTER_WINDOW at a time to keep
+# memory bounded; PDF_MAX_PAGES (0 for no limit) caps pages rendered per PDF
+PDF_RASTER_DPI = 150
+PDF_RASTER_GRAYSCALE = False
+PDF_RASTER_WINDOW = 2
+PDF_RASTER_THREADS = 1
+PDF_MAX_PAGES = 20
+
+# Local rule-based extraction for text content (.eml bodies, PDF text layers):
+# fields below this confidence are sent to the LLM
+RULE_MIN_CONFIDENCE = 0.75
+
+# Worker processes for PDF rasterization and image encoding (0 runs inline)
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+
+# Scanned PDF pages sent to the LLM per request
+PDF_PAGES_PER_REQUEST = 3
+
+# Images sent to the LLM are downscaled to this pixel budget and re-encoded;
+# Groq rejects base64 images over 4MB
+IMAGE_MAX_PIXELS = 2_000_000
+IMAGE_FORMAT = "JPEG"  # JPEG, WEBP or PNG
+IMAGE_QUALITY = 80
+IMAGE_MAX_PAYLOAD_BYTES = 4_000_000
+
+# Extraction cache
+EXTRACTION_CACHE_ENABLED = True
+EXTRACTION_CACHE_PATH = "extraction_cache.sqlite3"
+EXTRACTION_CACHE_MAX_ENTRIES = 10000
+EXTRACTION_CACHE_MAX_AGE_DAYS = 90
+
+# Poppler bin directory; leave unset to use poppler from PATH (e.g. on Linux)
+POPPLER_PATH = os.getenv("POPPLER_PATH") or None
+# Attachments above this size are skipped without downloading (Gmail's limit is 25 MB)
+ATTACHMENT_MAX_BYTES = 25 * 1024 * 1024
+# Nesting depth of MIME parts requested from messages.get
+MESSAGE_PART_DEPTH = 5
+# Attachments larger than this are spooled to a temporary file on disk
+ATTACHMENT_SPOOL_MAX_MEMORY = 5 * 1024 * 1024
+# Resumable Drive upload chunk size (must be a multiple of 256 KB)
+DRIVE_UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+
+# Local journal of per-attachment progress, used to resume interrupted work
+WORK_JOURNAL_PATH = "work_journal.sqlite3"
+
+# Metrics: Prometheus text file and/or local HTTP endpoint (port 0 disables),
+# plus a JSON summary per run in METRICS_SUMMARY_DIR. Empty disables each;
+# summaries are never pruned, so only enable them where something rotates them
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE", "")
+METRICS_HTTP_PORT = int(os.getenv("METRICS_HTTP_PORT", "0"))
+METRICS_SUMMARY_DIR = os.getenv("METRICS_SUMMARY_DIR", "")
 
-POPPLER_PATH = r"C:\poppler\Library\bin"
 # Supported file types
 SUPPORTED_MIME_TYPES = [
     'application/pdf',
@@ -37,4 +132,39 @@ SUPPORTED_MIME_TYPES = [
 ]
 
 # Automation settings
-SCHEDULE_HOURS = 3
\ No newline at end of file
+SCHEDULE_HOURS = 3
+
+# Processing pipeline: worker threads and queue depth per stage
+PIPELINE_STAGES = {
+    'fetch': {'workers': 2, 'queue_size': 20},
+    'download': {'workers': 4, 'queue_size': 20},
+    'extract': {'workers': 4, 'queue_size': 10},
+    'upload': {'workers': 3, 'queue_size': 10},
+}
+
+# What to do with an invoice whose vendor, number and amount are already in
+# the ledger: "skip" it (no upload, no row) or "flag" it with a note
+DUPLICATE_INVOICE_ACTION = "skip"
+
+# Sheet rows are appended in batches of up to this many rows, or once the
+# oldest buffered row reaches the max age, and at the end of each run
+SHEETS_BATCH_ROWS = 50
+SHEETS_BATCH_MAX_AGE_SECONDS = 30
+
+# Historical backfill: date range shards of BACKFILL_SHARD_DAYS processed by
+# BACKFILL_WORKERS processes, which split BACKFILL_API_CALLS_PER_MINUTE
+# evenly so the scheduled job keeps the rest of the Google quota
+BACKFILL_WORKERS = 4
+BACKFILL_SHARD_DAYS = 30
+BACKFILL_API_CALLS_PER_MINUTE = int(os.getenv("BACKFILL_API_CALLS_PER_MINUTE", "600"))
+BACKFILL_STATE_FILE = "backfill_state.json"
+
+# Multi-mailbox runner: accounts come from ACCOUNTS_FILE and share
+# ACCOUNT_WORKERS workers; each turn handles at most ACCOUNT_MESSAGES_PER_TURN
+# messages before the account goes to the back of the queue. Per-account
+# journals and checkpoints live under ACCOUNT_STATE_DIR/<name>/
+ACCOUNTS_FILE = os.getenv("ACCOUNTS_FILE", "accounts.json")
+ACCOUNT_WORKERS = 4
+ACCOUNT_MESSAGES_PER_TURN = 100
+ACCOUNT_API_CALLS_PER_MINUTE = 300  # per account, 0 for no cap
+ACCOUNT_STATE_DIR = "accounts"
@@ -1,5 +1,8 @@
+import sys
+
 from services.auth_service import AuthService
 
 if __name__ == "__main__":
-    auth_service = AuthService()
-    auth_service.authenticate()
\ No newline at end of file
+    # Optional token path, e.g. one per account for multi_account.py
+    auth_service = AuthService(*sys.argv[1:2])
+    auth_service.authenticate()
@@ -0,0 +1,150 @@
+"""
+Multi-mailbox runner: processes many accounts on a shared pool of workers
+with per-account API budgets and round-robin turns
+"""
+import argparse
+import threading
+import time
+from collections import deque
+from typing import Dict, List
+
+import schedule
+
+from app import InvoiceProcessor
+from config import (
+    ACCOUNTS_FILE, ACCOUNT_WORKERS, ACCOUNT_MESSAGES_PER_TURN, SCHEDULE_HOURS,
+    METRICS_TEXTFILE, METRICS_HTTP_PORT, METRICS_SUMMARY_DIR
+)
+from services.accounts import Account, load_accounts
+from services.metrics import metrics
+
+
+class AccountScheduler:
+    """Runs accounts in turns of at most messages_per_turn emails.
+
+    An account with mail left after its turn goes to the back of the queue,
+    so a busy mailbox gets one turn at a time while quieter ones keep
+    getting theirs. Each account's Google calls are charged to its own
+    budget (Account.api_calls_per_minute).
+    """
+
+    def __init__(self, accounts: List[Account], workers: int = ACCOUNT_WORKERS,
+                 messages_per_turn: int = ACCOUNT_MESSAGES_PER_TURN):
+        self.workers = max(1, workers)
+        self.processors = []
+        for account in accounts:
+            processor = InvoiceProcessor(account, max_messages=messages_per_turn)
+            processor.owns_metrics = False
+            # Never block a shared worker on a browser login
+            processor.auth_service.interactive = False
+            self.processors.append(processor)
+        self._queue = deque()
+        self._active = 0
+        self._cond = threading.Condition()
+        self._processed: Dict[str, int] = {}
+
+    def run_cycle(self):
+        """Give every account turns until none has mail left"""
+        print(f"Starting cycle for {len(self.processors)} accounts on {self.workers} workers")
+        metrics.reset()
+        started = time.perf_counter()
+        self._processed = {processor.account.name: 0 for processor in self.processors}
+        with self._cond:
+            self._queue.extend(self.processors)
+            self._active = 0
+
+        threads = [
+            threading.Thread(target=self._worker, name=f"account-worker-{n}", daemon=True)
+            for n in range(min(self.workers, len(self.processors)))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        print(f"Cycle complete in {time.perf_counter() - started:.1f}s: {self._processed}")
+        self._publish_metrics()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                # Wait while others run: their accounts may be requeued
+                while not self._queue and self._active:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                processor = self._queue.popleft()
+                self._active += 1
+
+            more = False
+            try:
+                more = self._run_turn(processor)
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    if more:
+                        self._queue.append(processor)
+                    self._cond.notify_all()
+
+    def _run_turn(self, processor: InvoiceProcessor) -> bool:
+        """Process one turn; True if the account likely has more mail"""
+        name = processor.account.name
+        processor.process_emails()
+        processed = processor._processed_count
+        self._processed[name] += processed
+        metrics.inc('account_processed_attachments_total', processed, {'account': name},
+                    'Attachments processed per account')
+        metrics.inc('account_turns_total', labels={'account': name},
+                    help_text='Scheduling turns given to each account')
+
+        # A full turn suggests more mail is waiting; a turn that processed
+        # nothing would only list the same failing emails again
+        return (
+            processor.max_messages is not None
+            and processor._listed_count >= processor.max_messages
+            and processed > 0
+        )
+
+    def _publish_metrics(self):
+        try:
+            for processor in self.processors:
+                metrics.set_gauge('account_api_calls', processor.budget.calls,
+                                  {'account': processor.account.name},
+                                  'Google API calls charged to each account since start')
+            if METRICS_TEXTFILE:
+                metrics.write_textfile(METRICS_TEXTFILE)
+            if METRICS_SUMMARY_DIR:
+                print(f"Run summary written to {metrics.write_summary(METRICS_SUMMARY_DIR)}")
+        except Exception as e:
+            print(f"Error writing metrics: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process invoices for many mailboxes")
+    parser.add_argument('--accounts', default=ACCOUNTS_FILE, help="accounts JSON file")
+    parser.add_argument('--workers', type=int, default=ACCOUNT_WORKERS)
+    parser.add_argument('--messages-per-turn', type=int, default=ACCOUNT_MESSAGES_PER_TURN)
+    parser.add_argument('--once', action='store_true', help="run one cycle and exit")
+    args = parser.parse_args()
+
+    accounts = load_accounts(args.accounts)
+    print(f"Loaded {len(accounts)} accounts from {args.accounts}")
+    scheduler = AccountScheduler(accounts, workers=args.workers,
+                                 messages_per_turn=args.messages_per_turn)
+
+    if METRICS_HTTP_PORT:
+        metrics.serve(METRICS_HTTP_PORT)
+
+    scheduler.run_cycle()
+    if args.once:
+        return
+
+    schedule.every(SCHEDULE_HOURS).hours.do(scheduler.run_cycle)
+    print(f"Scheduler started. Running every {SCHEDULE_HOURS} hours...")
+    while True:
+        schedule.run_pending()
+        time.sleep(60)
+
+
+if __name__ == "__main__":
+    main()
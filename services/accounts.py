@@ -0,0 +1,81 @@
+"""
+Per-account (mailbox) settings for the multi-mailbox runner
+"""
+import json
+import os
+from typing import List
+from config import (
+    TOKEN_FILE, CREDENTIALS_FILE, SPREADSHEET_ID, DRIVE_FOLDER_NAME,
+    TARGET_SUBJECT, GMAIL_LABEL_NAME, WORK_JOURNAL_PATH, SYNC_CHECKPOINT_FILE,
+    ACCOUNT_API_CALLS_PER_MINUTE, ACCOUNT_STATE_DIR, BACKFILL_STATE_FILE
+)
+
+REQUIRED_FIELDS = ('name', 'token_file', 'spreadsheet_id')
+
+
+class Account:
+    """Credentials, targets and local state paths for one mailbox"""
+
+    def __init__(self, name: str, token_file: str = TOKEN_FILE,
+                 credentials_file: str = CREDENTIALS_FILE,
+                 spreadsheet_id: str = SPREADSHEET_ID,
+                 drive_folder_name: str = DRIVE_FOLDER_NAME,
+                 target_subject: str = TARGET_SUBJECT,
+                 label_name: str = GMAIL_LABEL_NAME,
+                 api_calls_per_minute: int = 0,
+                 work_journal_path: str = WORK_JOURNAL_PATH,
+                 sync_checkpoint_file: str = SYNC_CHECKPOINT_FILE,
+                 backfill_state_file: str = BACKFILL_STATE_FILE):
+        self.name = name
+        self.token_file = token_file
+        self.credentials_file = credentials_file
+        self.spreadsheet_id = spreadsheet_id
+        self.drive_folder_name = drive_folder_name
+        self.target_subject = target_subject
+        self.label_name = label_name
+        self.api_calls_per_minute = api_calls_per_minute
+        self.work_journal_path = work_journal_path
+        self.sync_checkpoint_file = sync_checkpoint_file
+        self.backfill_state_file = backfill_state_file
+
+    @classmethod
+    def default(cls) -> 'Account':
+        """The single mailbox configured in config.py"""
+        return cls('default')
+
+
+def load_accounts(path: str) -> List[Account]:
+    """Read accounts from a JSON file of the form {"accounts": [{...}, ...]}.
+
+    Each entry needs name, token_file and spreadsheet_id; other Account
+    fields are optional. Journals, sync checkpoints and backfill state
+    default to ACCOUNT_STATE_DIR/<name>/.
+    """
+    with open(path) as f:
+        entries = json.load(f).get('accounts', [])
+
+    accounts = []
+    names = set()
+    for entry in entries:
+        missing = [field for field in REQUIRED_FIELDS if not entry.get(field)]
+        if missing:
+            raise ValueError(f"Account entry {entry.get('name', '?')} is missing {', '.join(missing)}")
+        name = entry['name']
+        if name in names:
+            raise ValueError(f"Duplicate account name: {name}")
+        names.add(name)
+
+        state_dir = os.path.join(ACCOUNT_STATE_DIR, name)
+        os.makedirs(state_dir, exist_ok=True)
+        settings = {
+            'api_calls_per_minute': ACCOUNT_API_CALLS_PER_MINUTE,
+            'work_journal_path': os.path.join(state_dir, 'work_journal.sqlite3'),
+            'sync_checkpoint_file': os.path.join(state_dir, 'sync_checkpoint.json'),
+            'backfill_state_file': os.path.join(state_dir, 'backfill_state.json'),
+        }
+        settings.update(entry)
+        try:
+            accounts.append(Account(**settings))
+        except TypeError as e:
+            raise ValueError(f"Invalid settings for account {name}: {e}") from e
+    return accounts
@@ -0,0 +1,104 @@
+"""
+Spooled attachment storage shared by download, extraction and upload
+"""
+import base64
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Union
+
+# Base64 text decoded per step; a multiple of 4 so chunks decode independently
+_DECODE_CHUNK_CHARS = 4 * 256 * 1024
+
+
+class AttachmentHandle:
+    """Attachment bytes kept in memory up to a threshold, on disk above it.
+
+    The SHA-256 of the content is computed while writing, so consumers
+    (e.g. the extraction cache) never need another full pass.
+    """
+
+    def __init__(self, max_memory_bytes: int):
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory_bytes)
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    @classmethod
+    def from_base64(cls, data: str, max_memory_bytes: int) -> 'AttachmentHandle':
+        """Decode URL-safe base64 (as returned by Gmail) chunk by chunk"""
+        handle = cls(max_memory_bytes)
+        for start in range(0, len(data), _DECODE_CHUNK_CHARS):
+            chunk = data[start:start + _DECODE_CHUNK_CHARS]
+            chunk += '=' * (-len(chunk) % 4)
+            handle.write(base64.urlsafe_b64decode(chunk))
+        return handle
+
+    @classmethod
+    def from_bytes(cls, data: bytes, max_memory_bytes: int) -> 'AttachmentHandle':
+        handle = cls(max_memory_bytes)
+        handle.write(data)
+        return handle
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    @property
+    def spilled(self) -> bool:
+        return bool(getattr(self._file, '_rolled', False))
+
+    def write(self, chunk: bytes):
+        self._file.write(chunk)
+        self._hash.update(chunk)
+        self.size += len(chunk)
+
+    def open_stream(self) -> BinaryIO:
+        """The underlying file, rewound; readers should not close it"""
+        self._file.seek(0)
+        return self._file
+
+    def read_bytes(self) -> bytes:
+        return self.open_stream().read()
+
+    def close(self):
+        self._file.close()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __bool__(self) -> bool:
+        return self.size > 0
+
+
+AttachmentData = Union[bytes, AttachmentHandle]
+
+
+def as_stream(data: AttachmentData) -> BinaryIO:
+    return data.open_stream() if isinstance(data, AttachmentHandle) else io.BytesIO(data)
+
+
+def as_bytes(data: AttachmentData) -> bytes:
+    return data.read_bytes() if isinstance(data, AttachmentHandle) else data
+
+
+@contextmanager
+def temp_file_path(data: AttachmentData, suffix: str = '') -> Iterator[str]:
+    """Write the content once to a named temporary file and yield its path,
+    for worker processes that should read it from disk instead of having the
+    bytes pickled to them; the file is removed on exit"""
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(as_stream(data), f)
+        yield path
+    finally:
+        os.unlink(path)
+
+
+def content_sha256(data: AttachmentData) -> str:
+    if isinstance(data, AttachmentHandle):
+        return data.sha256
+    return hashlib.sha256(data).hexdigest()
@@ -3,37 +3,72 @@ Google API Authentication Service
 """
 import os
 import logging
+import threading
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
-from config import SCOPES, CREDENTIALS_FILE, TOKEN_FILE
+from config import SCOPES, CREDENTIALS_FILE, TOKEN_FILE, HTTP_POOL_SIZE, HTTP_TIMEOUT
+from services.http_transport import PooledHttp
+
+
+class ThreadLocalClient:
+    """Proxy that builds one API client per thread.
+
+    Clients are cheap to build from the bundled discovery documents and
+    all share AuthService's pooled transport, so each worker thread gets
+    its own Resource objects without opening new connections.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._factory()
+            self._local.client = client
+        return getattr(client, name)
 
 
 class AuthService:
-    def __init__(self):
+    def __init__(self, token_file: str = TOKEN_FILE, credentials_file: str = CREDENTIALS_FILE,
+                 interactive: bool = True):
+        self.token_file = token_file
+        self.credentials_file = credentials_file
+        # Headless runners set this to False so a missing or unrefreshable
+        # token fails fast instead of waiting on a browser login
+        self.interactive = interactive
         self.credentials = None
+        self._http = None
+        self._http_lock = threading.Lock()
         
     def authenticate(self):
         """Authenticate with Google APIs and return credentials"""
         try:
             # Load existing token
-            if os.path.exists(TOKEN_FILE):
-                self.credentials = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
+            if os.path.exists(self.token_file):
+                self.credentials = Credentials.from_authorized_user_file(self.token_file, SCOPES)
             
             # Refresh or get new credentials
             if not self.credentials or not self.credentials.valid:
                 if self.credentials and self.credentials.expired and self.credentials.refresh_token:
                     self.credentials.refresh(Request())
                 else:
-                    if not os.path.exists(CREDENTIALS_FILE):
-                        raise FileNotFoundError(f"Credentials file not found: {CREDENTIALS_FILE}")
+                    if not self.interactive:
+                        raise RuntimeError(
+                            f"No valid token in {self.token_file}; "
+                            f"run 'python generate_token.py {self.token_file}' to authorize"
+                        )
+                    if not os.path.exists(self.credentials_file):
+                        raise FileNotFoundError(f"Credentials file not found: {self.credentials_file}")
                     
-                    flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
+                    flow = InstalledAppFlow.from_client_secrets_file(self.credentials_file, SCOPES)
                     self.credentials = flow.run_local_server(port=0)
                 
                 # Save credentials
-                with open(TOKEN_FILE, 'w') as token:
+                with open(self.token_file, 'w') as token:
                     token.write(self.credentials.to_json())
             
             print("Authentication successful")
@@ -47,16 +82,33 @@ class AuthService:
         """Get Gmail API service"""
         if not self.credentials:
             self.authenticate()
-        return build('gmail', 'v1', credentials=self.credentials)
+        return ThreadLocalClient(lambda: self._build_client('gmail', 'v1'))
     
     def get_drive_service(self):
         """Get Drive API service"""
         if not self.credentials:
             self.authenticate()
-        return build('drive', 'v3', credentials=self.credentials)
+        return ThreadLocalClient(lambda: self._build_client('drive', 'v3'))
     
     def get_sheets_service(self):
         """Get Sheets API service"""
         if not self.credentials:
             self.authenticate()
-        return build('sheets', 'v4', credentials=self.credentials)
\ No newline at end of file
+        return ThreadLocalClient(lambda: self._build_client('sheets', 'v4'))
+    
+    def _get_http(self) -> PooledHttp:
+        """Keep-alive transport shared by every client built by this service"""
+        with self._http_lock:
+            if self._http is None:
+                self._http = PooledHttp(
+                    self.credentials, pool_size=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT
+                )
+            return self._http
+    
+    def _build_client(self, api: str, version: str):
+        # Static discovery uses the documents bundled with googleapiclient,
+        # so no discovery request is made at startup
+        return build(
+            api, version, http=self._get_http(),
+            static_discovery=True, cache_discovery=False
+        )
\ No newline at end of file
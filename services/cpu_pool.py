@@ -0,0 +1,48 @@
+"""
+Process pool for CPU-bound work (PDF rasterization, image encoding)
+"""
+import atexit
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
+
+from config import CPU_POOL_WORKERS
+
+_executor: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def get_cpu_pool() -> Optional[ProcessPoolExecutor]:
+    """Shared process pool, created on first use; None when disabled"""
+    global _executor
+    if CPU_POOL_WORKERS <= 0:
+        return None
+    with _lock:
+        if _executor is None:
+            # Spawn rather than fork: the parent is multi-threaded
+            _executor = ProcessPoolExecutor(
+                max_workers=CPU_POOL_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            atexit.register(shutdown_cpu_pool)
+        return _executor
+
+
+def run_cpu_bound(fn: Callable, *args, **kwargs):
+    """Run fn in the process pool, or inline when the pool is disabled.
+
+    Blocks the calling thread only, so other pipeline stages keep running.
+    """
+    pool = get_cpu_pool()
+    if pool is None:
+        return fn(*args, **kwargs)
+    return pool.submit(fn, *args, **kwargs).result()
+
+
+def shutdown_cpu_pool():
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
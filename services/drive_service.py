@@ -1,28 +1,49 @@
 """
 Google Drive Service for file operations
 """
-import io
+import threading
 from datetime import datetime
 from typing import Dict
 from googleapiclient.http import MediaIoBaseUpload
 from googleapiclient.errors import HttpError
-from config import DRIVE_FOLDER_NAME
+from config import DRIVE_FOLDER_NAME, DRIVE_UPLOAD_CHUNK_SIZE
+from services.attachment_handle import AttachmentData, as_stream, content_sha256
+from services.metrics import metrics, count_api_call
+from services.rate_limit import charge_api_calls
 
 
 
 class DriveService:
     FOLDER_NAME = DRIVE_FOLDER_NAME
     
-    def __init__(self, drive_service):
+    CONTENT_HASH_PROPERTY = 'contentSha256'
+    
+    def __init__(self, drive_service, folder_name: str = None):
         self.service = drive_service
-        self._ensure_folder_exists()
+        self.folder_name = folder_name or self.FOLDER_NAME
+        self._folder_id = None
+        self._folder_lock = threading.Lock()
+        self._get_folder_id()
+    
+    def _get_folder_id(self) -> str:
+        """Folder ID, resolved once and cached for the process lifetime"""
+        with self._folder_lock:
+            if not self._folder_id:
+                self._folder_id = self._ensure_folder_exists()
+            return self._folder_id
+    
+    def _invalidate_folder(self):
+        with self._folder_lock:
+            self._folder_id = None
         
     def _ensure_folder_exists(self):
         """Check if the target folder exists, create it if it doesn't"""
         try:
             # Check if folder exists
+            charge_api_calls('drive')
+            count_api_call('drive', 'files.list')
             response = self.service.files().list(
-                q=f"name='{self.FOLDER_NAME}' and mimeType='application/vnd.google-apps.folder' and trashed=false",
+                q=f"name='{self.folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false",
                 spaces='drive',
                 fields='files(id, name)'
             ).execute()
@@ -30,10 +51,12 @@ class DriveService:
             if not response.get('files'):
                 # Folder doesn't exist, create it
                 folder_metadata = {
-                    'name': self.FOLDER_NAME,
+                    'name': self.folder_name,
                     'mimeType': 'application/vnd.google-apps.folder'
                 }
                     
+                charge_api_calls('drive')
+                count_api_call('drive', 'files.create')
                 folder = self.service.files().create(
                     body=folder_metadata,
                     fields='id, name'
@@ -48,30 +71,25 @@ class DriveService:
             print(f"Error ensuring folder exists: {e}")
             return None
     
-    def upload_file(self, file_data: bytes, original_filename: str, 
+    def upload_file(self, file_data: AttachmentData, original_filename: str, 
                    mime_type: str, invoice_data: Dict) -> str:
         try:
-            new_filename = self._generate_filename(original_filename, invoice_data)
-            
-            media = MediaIoBaseUpload(
-                io.BytesIO(file_data),
-                mimetype=mime_type,
-                resumable=True
-            )
-            file_metadata = {
-                'name': new_filename,
-                'parents': [self._ensure_folder_exists()]
-            }
-            
-            file = self.service.files().create(
-                body=file_metadata,
-                media_body=media,
-                fields='id,webViewLink'
-            ).execute()
-            
-            file_url = file.get('webViewLink', '')
-            print(f"Uploaded file: {new_filename}")
-            return file_url
+            content_hash = content_sha256(file_data)
+            try:
+                return self._upload_to_folder(
+                    self._get_folder_id(), file_data, original_filename,
+                    mime_type, invoice_data, content_hash
+                )
+            except HttpError as error:
+                if error.resp.status != 404:
+                    raise
+                # Cached folder was deleted; resolve it again and retry once
+                print("Drive folder not found, resolving it again")
+                self._invalidate_folder()
+                return self._upload_to_folder(
+                    self._get_folder_id(), file_data, original_filename,
+                    mime_type, invoice_data, content_hash
+                )
             
         except HttpError as error:
             print(f"Error uploading file to Drive: {error}")
@@ -80,6 +98,60 @@ class DriveService:
             print(f"Unexpected error uploading file: {error}")
             return ""
     
+    def _upload_to_folder(self, folder_id: str, file_data: AttachmentData,
+                          original_filename: str, mime_type: str,
+                          invoice_data: Dict, content_hash: str) -> str:
+        existing_url = self._find_by_hash(folder_id, content_hash)
+        if existing_url:
+            print(f"File already uploaded, reusing: {original_filename}")
+            metrics.inc('drive_dedupe_hits_total', help_text='Uploads skipped because the content already exists')
+            return existing_url
+        
+        new_filename = self._generate_filename(original_filename, invoice_data)
+        
+        # Upload straight from the attachment handle in bounded chunks
+        media = MediaIoBaseUpload(
+            as_stream(file_data),
+            mimetype=mime_type,
+            chunksize=DRIVE_UPLOAD_CHUNK_SIZE,
+            resumable=True
+        )
+        file_metadata = {
+            'name': new_filename,
+            'parents': [folder_id],
+            'appProperties': {self.CONTENT_HASH_PROPERTY: content_hash}
+        }
+        
+        charge_api_calls('drive')
+        count_api_call('drive', 'files.create')
+        file = self.service.files().create(
+            body=file_metadata,
+            media_body=media,
+            fields='id,webViewLink'
+        ).execute()
+        
+        file_url = file.get('webViewLink', '')
+        metrics.inc('drive_upload_bytes_total', len(file_data), help_text='Bytes uploaded to Drive')
+        print(f"Uploaded file: {new_filename}")
+        return file_url
+    
+    def _find_by_hash(self, folder_id: str, content_hash: str) -> str:
+        """webViewLink of a file in the folder with the same content, if any"""
+        charge_api_calls('drive')
+        count_api_call('drive', 'files.list')
+        response = self.service.files().list(
+            q=(
+                f"appProperties has {{ key='{self.CONTENT_HASH_PROPERTY}' and value='{content_hash}' }}"
+                f" and '{folder_id}' in parents and trashed=false"
+            ),
+            spaces='drive',
+            fields='files(id, webViewLink)',
+            pageSize=1
+        ).execute()
+        
+        files = response.get('files', [])
+        return files[0].get('webViewLink', '') if files else ''
+    
     def _generate_filename(self, original_filename: str, invoice_data: Dict) -> str:
         current_date = datetime.now().strftime("%d.%m.%Y")
         
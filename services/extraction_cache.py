@@ -0,0 +1,92 @@
+"""
+Persistent, content-addressed cache for invoice extraction results
+"""
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+from services.attachment_handle import AttachmentData, content_sha256
+from services.metrics import metrics
+
+
+class ExtractionCache:
+    """SQLite-backed cache keyed by attachment bytes, model and prompt version.
+
+    Entries older than max_age_days are dropped, and the least recently used
+    entries are evicted once there are more than max_entries.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000, max_age_days: int = 90):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            '''CREATE TABLE IF NOT EXISTS extractions (
+                key TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )'''
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(file_data: AttachmentData, model: str, prompt_version: str) -> str:
+        return f"{content_sha256(file_data)}:{model}:{prompt_version}"
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT data, created_at FROM extractions WHERE key = ?', (key,)
+            ).fetchone()
+
+            if row is None or now - row[1] > self.max_age_seconds:
+                self.misses += 1
+                metrics.inc('extraction_cache_total', labels={'result': 'miss'},
+                            help_text='Extraction cache lookups')
+                return None
+
+            self._conn.execute(
+                'UPDATE extractions SET accessed_at = ? WHERE key = ?', (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            metrics.inc('extraction_cache_total', labels={'result': 'hit'})
+        return json.loads(row[0])
+
+    def put(self, key: str, data: Dict):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO extractions (key, data, created_at, accessed_at) '
+                'VALUES (?, ?, ?, ?)',
+                (key, json.dumps(data), now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+    def _evict(self, now: float):
+        self._conn.execute(
+            'DELETE FROM extractions WHERE created_at < ?',
+            (now - self.max_age_seconds,)
+        )
+        self._conn.execute(
+            'DELETE FROM extractions WHERE key IN ('
+            'SELECT key FROM extractions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
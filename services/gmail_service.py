@@ -2,37 +2,90 @@
 Gmail Service for email operations
 """
 import base64
-from typing import List, Dict, Optional
+import random
+import time
+from typing import List, Dict, Iterator, Optional
+import requests
 from googleapiclient.errors import HttpError
-from config import TARGET_SUBJECT, GMAIL_LABEL_NAME
+from config import (
+    MESSAGE_PART_DEPTH, TARGET_SUBJECT, GMAIL_LABEL_NAME, GMAIL_FETCH_BATCH_SIZE,
+    GMAIL_BATCH_MAX_RETRIES, GMAIL_BATCH_BACKOFF_BASE, GMAIL_BATCH_BACKOFF_MAX,
+    GMAIL_PAGE_SIZE, GMAIL_MAX_MESSAGES, ATTACHMENT_SPOOL_MAX_MEMORY,
+    ATTACHMENT_MAX_BYTES, SUPPORTED_MIME_TYPES
+)
+from services.attachment_handle import AttachmentHandle
+from services.metrics import metrics, count_api_call
+from services.rate_limit import charge_api_calls
+
+def _part_fields(depth: int) -> str:
+    fields = 'partId,filename,mimeType,body(attachmentId,size,data)'
+    if depth > 0:
+        fields += f',parts({_part_fields(depth - 1)})'
+    return fields
+
+
+# Partial response mask for messages.get: only what the pipeline reads
+MESSAGE_FIELDS = f'id,payload(headers(name,value),{_part_fields(MESSAGE_PART_DEPTH)})'
+
+
+# Connection resets and timeouts from the pooled (requests) or httplib2 transport
+TRANSPORT_ERRORS = (requests.exceptions.RequestException, ConnectionError, TimeoutError)
+
+
+def _is_retryable(error) -> bool:
+    """Rate limits, server errors and dropped connections are worth another
+    try; anything else (bad ID, deleted message, auth) will fail the same
+    way again"""
+    if isinstance(error, TRANSPORT_ERRORS):
+        return True
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status
+    return status == 429 or status >= 500
+
+
+class HistoryExpiredError(Exception):
+    """The stored historyId is older than the history Gmail keeps"""
+
 
 class GmailService:
-    def __init__(self, gmail_service):
+    BATCH_MODIFY_LIMIT = 1000  # Max ids accepted by messages.batchModify
+    supports_history = True  # Source can drive SYNC_MODE='history'
+    
+    def __init__(self, gmail_service, target_subject: str = TARGET_SUBJECT,
+                 label_name: str = GMAIL_LABEL_NAME):
         self.service = gmail_service
+        self.target_subject = target_subject
+        self.label_name = label_name
         self.processed_label_id = None
+        self.latest_history_id = None
         
     def get_or_create_label(self) -> Optional[str]:
         try:
+            charge_api_calls('gmail')
+            count_api_call('gmail', 'labels.list')
             labels = self.service.users().labels().list(userId='me').execute()
             for label in labels.get('labels', []):
-                if label['name'] == GMAIL_LABEL_NAME:
+                if label['name'] == self.label_name:
                     self.processed_label_id = label['id']
-                    print(f"Found existing label: {GMAIL_LABEL_NAME}")
+                    print(f"Found existing label: {self.label_name}")
                     return label['id']
             
             # Create new label
             label_object = {
-                'name': GMAIL_LABEL_NAME,
+                'name': self.label_name,
                 'labelListVisibility': 'labelShow',
                 'messageListVisibility': 'show'
             }
             
+            charge_api_calls('gmail')
+            count_api_call('gmail', 'labels.create')
             created_label = self.service.users().labels().create(
                 userId='me', body=label_object
             ).execute()
             
             self.processed_label_id = created_label['id']
-            print(f"Created new label: {GMAIL_LABEL_NAME}")
+            print(f"Created new label: {self.label_name}")
             return created_label['id']
             
         except HttpError as error:
@@ -40,45 +93,199 @@ class GmailService:
             return None
     
     def search_target_emails(self) -> List[str]:
-        try:
-            query = f'subject:{TARGET_SUBJECT} is:unread' # Search for unread emails with the target subject prefix
-            results = self.service.users().messages().list(
-                userId='me', q=query
-            ).execute()
+        message_ids = list(self.iter_target_emails())
+        print(f"Found {len(message_ids)} unread target emails")
+        return message_ids
+    
+    def iter_target_emails(self, query: Optional[str] = None,
+                           page_size: int = GMAIL_PAGE_SIZE,
+                           max_messages: Optional[int] = GMAIL_MAX_MESSAGES) -> Iterator[str]:
+        """Lazily yield target message IDs, following nextPageToken"""
+        if query is None:
+            query = self.unread_target_query()
+        yielded = 0
+        page_token = None
+        
+        while True:
+            try:
+                charge_api_calls('gmail')
+                count_api_call('gmail', 'messages.list')
+                results = self.service.users().messages().list(
+                    userId='me', q=query, maxResults=page_size, pageToken=page_token
+                ).execute()
+            except HttpError as error:
+                print(f"Error searching emails: {error}")
+                return
             
-            messages = results.get('messages', [])
-            message_ids = [msg['id'] for msg in messages]
-            print(f"Found {len(message_ids)} unread target emails")
-            return message_ids
+            for msg in results.get('messages', []):
+                if max_messages is not None and yielded >= max_messages:
+                    return
+                yielded += 1
+                yield msg['id']
             
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return
+    
+    def get_history_id(self) -> Optional[str]:
+        """Current mailbox historyId, used to start an incremental sync"""
+        try:
+            charge_api_calls('gmail')
+            count_api_call('gmail', 'getProfile')
+            profile = self.service.users().getProfile(userId='me').execute()
+            return profile.get('historyId')
         except HttpError as error:
-            print(f"Error searching emails: {error}")
-            return []
+            print(f"Error getting mailbox profile: {error}")
+            return None
+    
+    def iter_new_message_ids(self, start_history_id: str,
+                             page_size: int = GMAIL_PAGE_SIZE,
+                             max_messages: Optional[int] = None) -> Iterator[str]:
+        """Yield IDs of messages added since start_history_id.
+        
+        Raises HistoryExpiredError when Gmail no longer has history that far
+        back. After the generator is exhausted, latest_history_id holds the
+        checkpoint for the next sync; when max_messages stops it early, that
+        is the last history record whose messages were all yielded.
+        """
+        self.latest_history_id = start_history_id
+        yielded = 0
+        seen = set()
+        page_token = None
+        
+        while True:
+            try:
+                charge_api_calls('gmail')
+                count_api_call('gmail', 'history.list')
+                results = self.service.users().history().list(
+                    userId='me', startHistoryId=start_history_id,
+                    historyTypes=['messageAdded'], labelId='INBOX',
+                    maxResults=page_size, pageToken=page_token
+                ).execute()
+            except HttpError as error:
+                if error.resp.status == 404:
+                    raise HistoryExpiredError(start_history_id) from error
+                raise
+            
+            for record in results.get('history', []):
+                for added in record.get('messagesAdded', []):
+                    message = added['message']
+                    label_ids = message.get('labelIds', [])
+                    if message['id'] in seen or self.processed_label_id in label_ids:
+                        continue
+                    if max_messages is not None and yielded >= max_messages:
+                        return
+                    seen.add(message['id'])
+                    yielded += 1
+                    yield message['id']
+                self.latest_history_id = record.get('id', self.latest_history_id)
+            
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                self.latest_history_id = results.get('historyId', self.latest_history_id)
+                return
+    
+    def unread_target_query(self) -> str:
+        """Search for unread emails with the target subject prefix"""
+        return f'subject:{self.target_subject} is:unread'
+    
+    def unprocessed_target_query(self) -> str:
+        """Full-search query that relies on the Processed label, not UNREAD"""
+        return f'subject:{self.target_subject} -label:"{self.label_name}"'
+    
+    def is_target_subject(self, subject: str) -> bool:
+        return self.target_subject.lower() in (subject or '').lower()
     
     def get_email_with_attachments(self, message_id: str) -> Dict:
         try:
+            charge_api_calls('gmail')
+            count_api_call('gmail', 'messages.get')
             message = self.service.users().messages().get(
-                userId='me', id=message_id, format='full'
+                userId='me', id=message_id, format='full', fields=MESSAGE_FIELDS
             ).execute()
             
-            headers = message['payload'].get('headers', [])
-            subject = self._get_header_value(headers, 'Subject')
-            
-            attachments = []
-            self._find_attachments(message['payload'], attachments, message_id)
-            
-            return {
-                'id': message_id,
-                'subject': subject,
-                'attachments': attachments
-            }
+            return self._parse_message(message)
             
         except HttpError as error:
             print(f"Error getting email {message_id}: {error}")
             return {}
     
+    def get_emails_with_attachments(self, message_ids: List[str]) -> List[Dict]:
+        """Fetch many messages using Gmail batch HTTP requests, re-batching
+        those that failed with a rate limit or server error"""
+        emails = {}
+        retryable = {}
+        
+        def callback(request_id, response, exception):
+            if exception is not None:
+                if _is_retryable(exception):
+                    retryable[request_id] = exception
+                else:
+                    print(f"Error getting email {request_id}: {exception}")
+                return
+            try:
+                emails[request_id] = self._parse_message(response)
+            except (KeyError, TypeError) as error:
+                print(f"Error parsing email {request_id}: {error!r}")
+        
+        pending = list(message_ids)
+        for attempt in range(GMAIL_BATCH_MAX_RETRIES + 1):
+            if attempt:
+                # Full jitter exponential backoff
+                delay = random.uniform(0, min(GMAIL_BATCH_BACKOFF_MAX,
+                                              GMAIL_BATCH_BACKOFF_BASE * 2 ** (attempt - 1)))
+                print(f"Retrying {len(pending)} emails after transient errors in {delay:.1f}s")
+                time.sleep(delay)
+            retryable.clear()
+            
+            for start in range(0, len(pending), GMAIL_FETCH_BATCH_SIZE):
+                chunk = pending[start:start + GMAIL_FETCH_BATCH_SIZE]
+                batch = self.service.new_batch_http_request(callback=callback)
+                for message_id in chunk:
+                    batch.add(
+                        self.service.users().messages().get(
+                            userId='me', id=message_id, format='full', fields=MESSAGE_FIELDS
+                        ),
+                        request_id=message_id
+                    )
+                try:
+                    charge_api_calls('gmail', len(chunk))
+                    count_api_call('gmail', 'batch.messages.get', len(chunk))
+                    batch.execute()
+                except (HttpError, *TRANSPORT_ERRORS) as error:
+                    if not _is_retryable(error):
+                        print(f"Error executing batch fetch: {error}")
+                        continue
+                    for message_id in chunk:
+                        if message_id not in emails:
+                            retryable[message_id] = error
+            
+            if not retryable:
+                break
+            pending = list(retryable)
+        
+        for message_id, error in retryable.items():
+            print(f"Error getting email {message_id} after {GMAIL_BATCH_MAX_RETRIES} retries: {error}")
+        
+        return [emails[message_id] for message_id in message_ids if message_id in emails]
+    
+    def _parse_message(self, message: Dict) -> Dict:
+        headers = message['payload'].get('headers', [])
+        subject = self._get_header_value(headers, 'Subject')
+        
+        attachments = []
+        self._find_attachments(message['payload'], attachments, message['id'])
+        
+        return {
+            'id': message['id'],
+            'subject': subject,
+            'attachments': attachments
+        }
+    
     def download_attachment(self, message_id: str, attachment_id: str) -> bytes:
         try:            
+            charge_api_calls('gmail')
+            count_api_call('gmail', 'attachments.get')
             attachment = self.service.users().messages().attachments().get(
                 userId='me', messageId=message_id, id=attachment_id
             ).execute()
@@ -89,25 +296,87 @@ class GmailService:
             print(f"Error downloading attachment: {error}")
             return b''
     
-    def mark_as_processed(self, message_id: str):
+    def download_attachment_handle(self, message_id: str, attachment: Dict) -> Optional[AttachmentHandle]:
+        """Load an attachment into a spooled handle that spills to disk
+        above ATTACHMENT_SPOOL_MAX_MEMORY bytes.
+        
+        Inline data from the message fetch is used without another request.
+        """
+        inline_data = attachment.pop('data', None)
+        if inline_data:
+            handle = AttachmentHandle.from_base64(inline_data, ATTACHMENT_SPOOL_MAX_MEMORY)
+            metrics.inc('attachment_bytes_total', handle.size, {'source': 'inline'},
+                        'Attachment bytes received from Gmail')
+            return handle
+        
+        attachment_id = attachment.get('attachmentId')
+        if not attachment_id:
+            return None
+        
         try:
+            charge_api_calls('gmail')
+            count_api_call('gmail', 'attachments.get')
+            response = self.service.users().messages().attachments().get(
+                userId='me', messageId=message_id, id=attachment_id
+            ).execute()
+            
+            data = response.pop('data')
+            del response
+            handle = AttachmentHandle.from_base64(data, ATTACHMENT_SPOOL_MAX_MEMORY)
+            metrics.inc('attachment_bytes_total', handle.size, {'source': 'download'},
+                        'Attachment bytes received from Gmail')
+            return handle
+            
+        except HttpError as error:
+            print(f"Error downloading attachment: {error}")
+            return None
+    
+    def mark_as_processed(self, message_id: str) -> bool:
+        """Mark one email as processed; False if the request failed"""
+        try:
+            # Mark as read and add processed label in a single request
+            charge_api_calls('gmail')
+            count_api_call('gmail', 'messages.modify')
             self.service.users().messages().modify(
                 userId='me',
                 id=message_id,
-                body={'removeLabelIds': ['UNREAD']}
-            ).execute() # Mark as read
-            
-            if self.processed_label_id:
-                self.service.users().messages().modify(
-                    userId='me',
-                    id=message_id,
-                    body={'addLabelIds': [self.processed_label_id]}
-                ).execute() # Add processed label
+                body=self._processed_label_changes()
+            ).execute()
             
             print(f"Marked email {message_id} as processed")
+            return True
             
         except HttpError as error:
             print(f"Error marking email as processed: {error}")
+            return False
+    
+    def mark_many_as_processed(self, message_ids: List[str]) -> List[str]:
+        """Mark many emails as processed using messages.batchModify and
+        return the IDs that were actually marked"""
+        marked = []
+        for start in range(0, len(message_ids), self.BATCH_MODIFY_LIMIT):
+            chunk = message_ids[start:start + self.BATCH_MODIFY_LIMIT]
+            try:
+                body = self._processed_label_changes()
+                body['ids'] = chunk
+                charge_api_calls('gmail')
+                count_api_call('gmail', 'messages.batchModify')
+                self.service.users().messages().batchModify(
+                    userId='me', body=body
+                ).execute()
+                
+                print(f"Marked {len(chunk)} emails as processed")
+                marked.extend(chunk)
+                
+            except HttpError as error:
+                print(f"Error marking emails as processed: {error}")
+        return marked
+    
+    def _processed_label_changes(self) -> Dict:
+        body = {'removeLabelIds': ['UNREAD']}
+        if self.processed_label_id:
+            body['addLabelIds'] = [self.processed_label_id]
+        return body
     
     def _get_header_value(self, headers: List[Dict], name: str) -> str:
         for header in headers:
@@ -116,14 +385,30 @@ class GmailService:
         return ''
     
     def _find_attachments(self, payload, attachments, message_id):
+        """Collect supported attachments, skipping unsupported or oversized
+        parts so they are never downloaded"""
         if 'parts' in payload:
             for part in payload['parts']:
                 self._find_attachments(part, attachments, message_id)
         else:
-            if payload.get('filename'):
-                attachments.append({
-                    'filename': payload['filename'],
-                    'mimeType': payload['mimeType'],
-                    'attachmentId': payload['body'].get('attachmentId'),
-                    'size': payload['body'].get('size', 0)
-                })
\ No newline at end of file
+            if not payload.get('filename'):
+                return
+            
+            body = payload.get('body', {})
+            size = body.get('size', 0)
+            if payload.get('mimeType') not in SUPPORTED_MIME_TYPES:
+                return
+            if size > ATTACHMENT_MAX_BYTES:
+                print(f"Skipping oversized attachment {payload['filename']} ({size} bytes)")
+                return
+            
+            attachments.append({
+                'partId': payload.get('partId', ''),
+                'filename': payload['filename'],
+                'mimeType': payload['mimeType'],
+                'attachmentId': body.get('attachmentId'),
+                'size': size,
+                # Small parts come inline and need no separate download
+                'data': body.get('data')
+            })
+
@@ -0,0 +1,55 @@
+"""
+Shared, pooled HTTP transport for the Google API clients
+"""
+import time
+from urllib.parse import urlsplit
+
+import httplib2
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
+from services.metrics import metrics
+
+# Headers describing the wire encoding; requests has already decoded the body
+_DROPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding'}
+
+
+class PooledHttp:
+    """httplib2.Http-compatible adapter over a shared requests session.
+
+    googleapiclient only calls request() and reads status/headers from an
+    httplib2.Response, so this lets every client share one thread-safe,
+    keep-alive urllib3 connection pool with credential refresh handled by
+    AuthorizedSession.
+    """
+
+    def __init__(self, credentials, pool_size: int = 20, timeout: float = 60):
+        self.timeout = timeout
+        self.session = AuthorizedSession(credentials)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=5, connection_type=None):
+        host = urlsplit(uri).hostname or ''
+        started = time.perf_counter()
+        response = self.session.request(
+            method, uri, data=body, headers=headers, timeout=self.timeout
+        )
+        metrics.observe('http_request_seconds', time.perf_counter() - started, {'host': host},
+                        'Google API HTTP request latency')
+        sent = len(body) if isinstance(body, (bytes, str)) else 0
+        metrics.inc('http_bytes_total', sent, {'host': host, 'direction': 'sent'},
+                    'Bytes transferred to/from Google APIs')
+        metrics.inc('http_bytes_total', len(response.content), {'host': host, 'direction': 'received'})
+
+        info = {
+            key.lower(): value for key, value in response.headers.items()
+            if key.lower() not in _DROPPED_HEADERS
+        }
+        info['status'] = str(response.status_code)
+        resp = httplib2.Response(info)
+        resp.reason = response.reason
+        return resp, response.content
+
+    def close(self):
+        self.session.close()
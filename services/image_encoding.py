@@ -0,0 +1,100 @@
+"""
+Image preparation for LLM vision requests
+"""
+import base64
+import io
+import math
+import time
+from services.lazy_import import lazy_import
+
+_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'PNG': 'image/png',
+}
+
+MIN_QUALITY = 40
+
+
+class EncodedImage:
+    def __init__(self, data: str, mime_type: str, size: tuple, seconds: float):
+        self.data = data  # base64 text
+        self.mime_type = mime_type
+        self.size = size
+        self.seconds = seconds
+
+    @property
+    def payload_bytes(self) -> int:
+        return len(self.data)
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.data}"
+
+
+def encode_image(img: 'Image.Image', max_pixels: int, image_format: str = 'JPEG',
+                 quality: int = 80, max_payload_bytes: int = 4_000_000) -> EncodedImage:
+    """Downscale img to a pixel budget and encode it under a payload limit.
+
+    Quality is lowered first, then the image is shrunk further, until the
+    base64 payload fits within max_payload_bytes.
+    """
+    Image = lazy_import('PIL.Image')
+    started = time.perf_counter()
+    image_format = image_format.upper()
+
+    img = img.convert('L' if img.mode in ('1', 'L') else 'RGB')
+    if max_pixels and img.width * img.height > max_pixels:
+        scale = math.sqrt(max_pixels / (img.width * img.height))
+        img = img.resize(
+            (max(1, int(img.width * scale)), max(1, int(img.height * scale))),
+            Image.LANCZOS
+        )
+
+    while True:
+        data = _encode(img, image_format, quality)
+        if len(data) <= max_payload_bytes:
+            break
+        if image_format != 'PNG' and quality > MIN_QUALITY:
+            quality = max(MIN_QUALITY, quality - 15)
+        elif img.width > 1 and img.height > 1:
+            img = img.resize((max(1, img.width * 3 // 4), max(1, img.height * 3 // 4)), Image.LANCZOS)
+        else:
+            break
+
+    return EncodedImage(
+        data, _MIME_TYPES.get(image_format, 'image/jpeg'), img.size,
+        time.perf_counter() - started
+    )
+
+
+def _encode(img: 'Image.Image', image_format: str, quality: int) -> str:
+    buffered = io.BytesIO()
+    if image_format == 'PNG':
+        img.save(buffered, format='PNG', optimize=True)
+    else:
+        img.save(buffered, format=image_format, quality=quality)
+    return base64.b64encode(buffered.getvalue()).decode('ascii')
+
+
+def encode_image_file(file_data: bytes, **encode_options) -> EncodedImage:
+    """Open image bytes and encode them; safe to run in a worker process"""
+    Image = lazy_import('PIL.Image')
+    with Image.open(io.BytesIO(file_data)) as img:
+        return encode_image(img, **encode_options)
+
+
+def rasterize_pdf_pages(pdf_path: str, first_page: int, last_page: int,
+                        raster_options: dict, encode_options: dict) -> list:
+    """Render a page range of the PDF at pdf_path and return encoded pages
+    rather than PIL images, so only a path goes into the worker and only
+    compact base64 payloads come back."""
+    pdf2image = lazy_import('pdf2image')
+
+    images = pdf2image.convert_from_path(
+        pdf_path, first_page=first_page, last_page=last_page, **raster_options
+    )
+    encoded = [encode_image(img, **encode_options) for img in images]
+    for img in images:
+        img.close()
+    return encoded
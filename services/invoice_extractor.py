@@ -1,24 +1,96 @@
 """
 Data extraction service for invoice processing
 """
-import io
-import base64
-from typing import Dict, List
-from pdf2image import convert_from_bytes
-from PIL import Image
-from groq import Groq
+import itertools
+import re
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional
 import json
-from config import GROQ_API_KEY, POPPLER_PATH
+from config import (
+    GROQ_API_KEY, POPPLER_PATH, LLM_MODEL, PROMPT_VERSION,
+    GROQ_REQUESTS_PER_MINUTE, GROQ_TOKENS_PER_MINUTE, GROQ_MAX_IN_FLIGHT,
+    GROQ_MAX_RETRIES, GROQ_BACKOFF_BASE, GROQ_BACKOFF_MAX,
+    PDF_TEXT_MIN_CHARS, PDF_TEXT_MIN_SCORE, PDF_PAGES_PER_REQUEST,
+    RULE_MIN_CONFIDENCE,
+    PDF_RASTER_DPI, PDF_RASTER_GRAYSCALE, PDF_RASTER_WINDOW,
+    PDF_RASTER_THREADS, PDF_MAX_PAGES,
+    IMAGE_MAX_PIXELS, IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_MAX_PAYLOAD_BYTES,
+    EXTRACTION_CACHE_ENABLED, EXTRACTION_CACHE_PATH,
+    EXTRACTION_CACHE_MAX_ENTRIES, EXTRACTION_CACHE_MAX_AGE_DAYS
+)
+from services.extraction_cache import ExtractionCache
+from services.image_encoding import (
+    EncodedImage, encode_image, encode_image_file, rasterize_pdf_pages
+)
+from services.cpu_pool import run_cpu_bound
+from services.attachment_handle import AttachmentData, as_bytes, as_stream, temp_file_path
+from services.llm_client import RateLimitedLLMClient, LLMUnavailableError
+from services.rule_extractor import RuleBasedExtractor
+from services.lazy_import import lazy_import, optional_import
+from services.metrics import metrics
 
-# Optional PDF processing
-try:
-    import PyPDF2
-    PDF_AVAILABLE = True
-except ImportError:
-    PDF_AVAILABLE = False
-    print("PyPDF2 not available. PDF text extraction disabled.")
+# groq, pdf2image, PIL and PyPDF2 are imported on first use so that runs
+# which find no mail never pay for them
+_client = None
+_client_lock = threading.Lock()
 
-client = Groq(api_key=GROQ_API_KEY)
+
+def get_llm_client() -> RateLimitedLLMClient:
+    """Shared LLM client, constructed on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            groq = lazy_import('groq')
+            # Retries are handled by the wrapper, which also honors Retry-After
+            _client = RateLimitedLLMClient(
+                groq.Groq(api_key=GROQ_API_KEY, max_retries=0),
+                requests_per_minute=GROQ_REQUESTS_PER_MINUTE,
+                tokens_per_minute=GROQ_TOKENS_PER_MINUTE,
+                max_in_flight=GROQ_MAX_IN_FLIGHT,
+                max_retries=GROQ_MAX_RETRIES,
+                backoff_base=GROQ_BACKOFF_BASE,
+                backoff_max=GROQ_BACKOFF_MAX
+            )
+        return _client
+
+EXTRACTION_PROMPT = '''
+                            Extract all text from this invoice image in a structured way. The images may be consecutive pages of one invoice. Include invoice number, date, vendor name, and total amount if available.
+                            Return only valid JSON in this format:
+                            {
+                            "vendor_name": "...",
+                            "invoice_date": "...",
+                            "total_amount": "...",
+                            "invoice_number": "..."
+                            }
+                            If any field is not found, use "N/A" as the value.
+                            '''
+
+ENCODE_OPTIONS = {
+    'max_pixels': IMAGE_MAX_PIXELS,
+    'image_format': IMAGE_FORMAT,
+    'quality': IMAGE_QUALITY,
+    'max_payload_bytes': IMAGE_MAX_PAYLOAD_BYTES,
+}
+
+RASTER_OPTIONS = {
+    'dpi': PDF_RASTER_DPI,
+    'grayscale': PDF_RASTER_GRAYSCALE,
+    'thread_count': PDF_RASTER_THREADS,
+    'poppler_path': POPPLER_PATH,
+}
+
+INVOICE_FIELDS = ('vendor_name', 'invoice_date', 'total_amount', 'invoice_number')
+
+# Signals that a PDF text layer carries real invoice content
+_TEXT_FIELD_SIGNALS = [
+    re.compile(r'\b(invoice|bill|inv)\.?\s*(no|number|num|#)', re.IGNORECASE),
+    re.compile(
+        r'\b\d{1,4}[./-]\d{1,2}[./-]\d{1,4}\b'
+        r'|\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d{1,2}',
+        re.IGNORECASE
+    ),
+    re.compile(r'\b(total|amount due|balance due|grand total)\b', re.IGNORECASE),
+]
 
 class LLMService:
     """Service for interacting with LLM for text extraction. Uses LLm because it is best for scanned images"""
@@ -29,11 +101,20 @@ class LLMService:
             if not isinstance(images, list):
                 images = [images]
                 
-            img_str_arr = []
-            for img in images:
-                buffered = io.BytesIO()
-                img.convert('RGB').save(buffered, format="PNG")
-                img_str_arr.append(base64.b64encode(buffered.getvalue()).decode('utf-8'))
+            # Pages rendered in the CPU pool arrive already encoded
+            encoded_images = [
+                img if isinstance(img, EncodedImage) else encode_image(img, **ENCODE_OPTIONS)
+                for img in images
+            ]
+            metrics.inc('llm_image_bytes_total', sum(e.payload_bytes for e in encoded_images),
+                        help_text='Base64 image bytes sent to the LLM')
+            for encoded in encoded_images:
+                metrics.observe('image_encode_seconds', encoded.seconds, help_text='Image encoding time')
+            print(
+                f"Encoded {len(encoded_images)} image(s): "
+                f"{sum(e.payload_bytes for e in encoded_images)} bytes in "
+                f"{sum(e.seconds for e in encoded_images):.3f}s"
+            )
             
             messages = [
                 {
@@ -41,45 +122,83 @@ class LLMService:
                     "content": [
                         {
                             "type": "text",
-                            "text": '''
-                            Extract all text from this invoice image in a structured way. Include invoice number, date, vendor name, and total amount if available.
-                            Return only valid JSON in this format:
-                            {
-                            "vendor_name": "...",
-                            "invoice_date": "...",
-                            "total_amount": "...",
-                            "invoice_number": "..."
-                            }
-                            If any field is not found, use "N/A" as the value.
-                            '''
+                            "text": EXTRACTION_PROMPT
                         }
                     ]
                 }
             ]
             
-            for img_str in img_str_arr:
+            for encoded in encoded_images:
                 messages[0]["content"].append({
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/png;base64,{img_str}"}
+                    "image_url": {"url": encoded.data_url}
                 })
             
-            response = client.chat.completions.create(
-                model="meta-llama/llama-4-scout-17b-16e-instruct",
+            response = get_llm_client().create_chat_completion(
+                model=LLM_MODEL,
                 messages=messages,
                 response_format={"type": "json_object"}
             )
             
             return response.choices[0].message.content
             
+        except LLMUnavailableError:
+            # Let the attachment fail rather than log it with empty fields
+            raise
         except Exception as e:
             print(f"Error extracting text with LLM: {e}")
             return ""
+    
+    @staticmethod
+    def extract_fields_from_text(text: str) -> str:
+        """Extract invoice fields from an already-extracted text layer"""
+        try:
+            messages = [
+                {
+                    "role": "user",
+                    "content": EXTRACTION_PROMPT.replace('this invoice image', 'this invoice text')
+                               + "\n\nInvoice text:\n" + text
+                }
+            ]
+            
+            response = get_llm_client().create_chat_completion(
+                model=LLM_MODEL,
+                messages=messages,
+                response_format={"type": "json_object"}
+            )
+            
+            return response.choices[0].message.content
+            
+        except LLMUnavailableError:
+            # Let the attachment fail rather than log it with empty fields
+            raise
+        except Exception as e:
+            print(f"Error extracting fields from text with LLM: {e}")
+            return ""
 
 class ExtractionService:
     
-    def extract_invoice_data(self, file_data: bytes, filename: str, mime_type: str) -> Dict:
+    def __init__(self, cache: Optional[ExtractionCache] = None):
+        if cache is None and EXTRACTION_CACHE_ENABLED:
+            cache = ExtractionCache(
+                EXTRACTION_CACHE_PATH,
+                max_entries=EXTRACTION_CACHE_MAX_ENTRIES,
+                max_age_days=EXTRACTION_CACHE_MAX_AGE_DAYS
+            )
+        self.cache = cache
+        self.rule_extractor = RuleBasedExtractor()
+    
+    def extract_invoice_data(self, file_data: AttachmentData, filename: str, mime_type: str) -> Dict:
         print(f"Extracting data from {filename} ({mime_type})")
         
+        cache_key = None
+        if self.cache:
+            cache_key = ExtractionCache.make_key(file_data, LLM_MODEL, PROMPT_VERSION)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                print(f"Using cached extraction for {filename}")
+                return cached
+        
         # Initialize with default values
         extracted_data = {
             'invoice_date': 'N/A',
@@ -88,30 +207,36 @@ class ExtractionService:
             'total_amount': 'N/A'
         }
         
-        # Extract text based on file type
-        text_content = self._extract_text(file_data, mime_type)
-        if text_content:
-            extracted_data = self._parse_text_content(text_content)
+        if mime_type == 'application/pdf':
+            extracted_data = self._merge_fields(extracted_data, self._extract_pdf_fields(file_data))
+        elif mime_type == 'message/rfc822':
+            text_content = self._extract_text(file_data, mime_type)
+            if text_content:
+                extracted_data = self._merge_fields(
+                    extracted_data, self._extract_fields_from_text(text_content)
+                )
+        else:
+            # Extract text based on file type
+            text_content = self._extract_text(file_data, mime_type)
+            if text_content:
+                extracted_data = self._parse_text_content(text_content)
         print(extracted_data)
+        
+        # Only cache useful results so failed extractions are retried
+        if cache_key and any(value not in ('', 'N/A') for value in extracted_data.values()):
+            self.cache.put(cache_key, extracted_data)
         return extracted_data
     
-    def _extract_text(self, file_data: bytes, mime_type: str) -> str:
+    def _extract_text(self, file_data: AttachmentData, mime_type: str) -> str:
         text_content = ""
         
-        if mime_type == 'application/pdf':
-            images = self._convert_pdf_to_images(file_data)
-            if images:
-                llm_service = LLMService()
-                for img in images:
-                    extracted_text = llm_service.extract_text_from_image([img])
-                    if extracted_text:
-                        text_content += extracted_text + "\n\n"
-                            
-        elif mime_type.startswith('image/'):
+        if mime_type.startswith('image/'):
             try:
-                image = Image.open(io.BytesIO(file_data))
+                encoded = run_cpu_bound(encode_image_file, as_bytes(file_data), **ENCODE_OPTIONS)
                 llm_service = LLMService()
-                text_content = llm_service.extract_text_from_image(image)
+                text_content = llm_service.extract_text_from_image(encoded)
+            except LLMUnavailableError:
+                raise
             except Exception as e:
                 print(f"Error processing image: {e}")
                 
@@ -121,7 +246,7 @@ class ExtractionService:
                 from email.parser import BytesParser
                 
                 # Parse the email
-                msg = BytesParser(policy=policy.default).parsebytes(file_data)
+                msg = BytesParser(policy=policy.default).parse(as_stream(file_data))
                 
                 # Extract text from email body
                 if msg.is_multipart():
@@ -156,39 +281,169 @@ class ExtractionService:
                         text_content = msg.as_string()
                     except Exception as e:
                         print(f"Error getting raw email content: {e}")
+                
+                # Sender display name is a useful vendor hint for the rules
+                if msg['From']:
+                    text_content = f"From: {msg['From']}\n\n{text_content}"
                         
             except Exception as e:
                 print(f"Error processing .eml file: {e}")
                 # Fallback to basic text extraction
-                text_content = file_data.decode('utf-8', errors='ignore')
+                text_content = as_bytes(file_data).decode('utf-8', errors='ignore')
         
         return text_content.strip()
         
-    def _convert_pdf_to_images(self, pdf_data: bytes) -> List[Image.Image]:
+    def _extract_pdf_fields(self, file_data: AttachmentData) -> Dict:
+        """Use the PDF text layer where it is usable, images for the rest"""
+        page_texts = self._extract_pdf_page_texts(file_data)
+        text_pages = [
+            text for text in page_texts
+            if len(text) >= PDF_TEXT_MIN_CHARS
+        ]
+        fields = {}
+        
+        if text_pages and self._score_invoice_text("\n".join(text_pages)) >= PDF_TEXT_MIN_SCORE:
+            print(f"Using PDF text layer for {len(text_pages)} of {len(page_texts)} pages")
+            fields = self._extract_fields_from_text("\n\n".join(text_pages))
+            scanned_pages = [
+                number for number, text in enumerate(page_texts, start=1)
+                if len(text) < PDF_TEXT_MIN_CHARS
+            ]
+            if not scanned_pages or self._fields_complete(fields):
+                return fields
+        else:
+            # No usable text layer (or unreadable PDF): rasterize every page
+            scanned_pages = None
+        
+        images = self._render_pdf_pages(file_data, scanned_pages)
+        return self._extract_fields_from_pages(images, fields)
+    
+    def _extract_fields_from_text(self, text: str) -> Dict:
+        """Extract fields with local rules, asking the LLM only for low-confidence fields"""
+        fields, confidence = self.rule_extractor.extract(text)
+        uncertain = [
+            field for field in INVOICE_FIELDS
+            if confidence[field] < RULE_MIN_CONFIDENCE
+        ]
+        if not uncertain:
+            print("Extracted all fields with local rules")
+            return fields
+        
+        print(f"Low-confidence rule fields {uncertain}, falling back to LLM")
+        llm_fields = self._parse_text_content(
+            LLMService.extract_fields_from_text(RuleBasedExtractor.normalize_text(text))
+        )
+        for field in uncertain:
+            if not self._is_missing(llm_fields.get(field)):
+                fields[field] = llm_fields[field]
+        return fields
+    
+    def _extract_fields_from_pages(self, images: Iterable[EncodedImage], fields: Dict) -> Dict:
+        """Send pages to the LLM in batches, stopping once every field is found.
+        
+        images may be a lazy iterator, so stopping early also skips
+        rasterizing the remaining pages.
+        """
+        llm_service = LLMService()
+        batch_size = max(1, PDF_PAGES_PER_REQUEST)
+        images = iter(images)
+        
+        while True:
+            batch = list(itertools.islice(images, batch_size))
+            if not batch:
+                break
+            batch_fields = self._parse_text_content(llm_service.extract_text_from_image(batch))
+            fields = self._merge_fields(fields, batch_fields)
+            del batch
+            
+            if self._fields_complete(fields):
+                print("All fields found, skipping remaining pages")
+                break
+        return fields
+    
+    def _render_pdf_pages(self, file_data: AttachmentData,
+                          pages: Optional[List[int]] = None) -> Iterator[EncodedImage]:
+        """Lazily rasterize and encode a PDF, optionally only the given 1-based pages.
+        
+        Pages are rendered PDF_RASTER_WINDOW at a time in the CPU pool, so
+        only a small window of encoded pages is alive at once regardless of
+        PDF size, and the calling thread is free while poppler runs.
+        """
         try:
-            images = convert_from_bytes(pdf_data, poppler_path=POPPLER_PATH)
-            return images
+            # Write the PDF to disk once; every window's worker opens the
+            # same file instead of receiving a pickled copy of the bytes
+            with temp_file_path(file_data, suffix='.pdf') as pdf_path:
+                if pages is None:
+                    pdf2image = lazy_import('pdf2image')
+                    page_count = pdf2image.pdfinfo_from_path(pdf_path, poppler_path=POPPLER_PATH)['Pages']
+                    pages = list(range(1, page_count + 1))
+            
+                if PDF_MAX_PAGES and len(pages) > PDF_MAX_PAGES:
+                    print(f"Limiting rasterization to {PDF_MAX_PAGES} of {len(pages)} pages")
+                    pages = pages[:PDF_MAX_PAGES]
+            
+                window = max(1, PDF_RASTER_WINDOW)
+                index = 0
+                while index < len(pages):
+                    # Render runs of consecutive pages in one poppler call
+                    first_page = last_page = pages[index]
+                    index += 1
+                    while (index < len(pages) and pages[index] == last_page + 1
+                           and last_page - first_page + 1 < window):
+                        last_page = pages[index]
+                        index += 1
+                
+                    with metrics.timer('pdf_rasterize_seconds', help_text='Poppler rendering time per page window'):
+                        encoded_pages = run_cpu_bound(
+                            rasterize_pdf_pages, pdf_path, first_page, last_page,
+                            RASTER_OPTIONS, ENCODE_OPTIONS
+                        )
+                    yield from encoded_pages
         except Exception as e:
             print(f"Error converting PDF to images: {e}")
-            return []
     
-    def _extract_pdf_text(self, file_data: bytes) -> str:
-        if not PDF_AVAILABLE:
-            return ""
+    def _extract_pdf_text(self, file_data: AttachmentData) -> str:
+        return "\n".join(text for text in self._extract_pdf_page_texts(file_data) if text)
+    
+    def _extract_pdf_page_texts(self, file_data: AttachmentData) -> List[str]:
+        """Text layer of each PDF page; empty strings for pages without one"""
+        # Optional PDF processing
+        PyPDF2 = optional_import('PyPDF2')
+        if PyPDF2 is None:
+            print("PyPDF2 not available. PDF text extraction disabled.")
+            return []
             
         try:
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_data))
-            text_content = ""
-            for page in pdf_reader.pages:
-                text = page.extract_text()
-                if text:  # Only add non-empty text
-                    text_content += text + "\n"
-            return text_content.strip()
+            pdf_reader = PyPDF2.PdfReader(as_stream(file_data))
+            return [(page.extract_text() or "").strip() for page in pdf_reader.pages]
         except Exception as e:
             print(f"PDF text extraction failed: {e}")
-            return ""
+            return []
+    
+    @staticmethod
+    def _score_invoice_text(text: str) -> float:
+        """Fraction of invoice field signals (number, date, total) found in text"""
+        matched = sum(1 for pattern in _TEXT_FIELD_SIGNALS if pattern.search(text))
+        return matched / len(_TEXT_FIELD_SIGNALS)
+    
+    @staticmethod
+    def _is_missing(value) -> bool:
+        return value is None or str(value).strip() in ('', 'N/A')
+    
+    def _fields_complete(self, fields: Dict) -> bool:
+        return all(not self._is_missing(fields.get(field)) for field in INVOICE_FIELDS)
+    
+    def _merge_fields(self, base: Dict, new: Dict) -> Dict:
+        """Fill fields missing from base with values found in new"""
+        merged = dict(base)
+        for field in INVOICE_FIELDS:
+            if self._is_missing(merged.get(field)) and not self._is_missing(new.get(field)):
+                merged[field] = new[field]
+        return merged
     
     def _parse_text_content(self, text: str) -> Dict:
+        if not text:
+            return {}
         try:
             return json.loads(text)
         except Exception as e:
@@ -0,0 +1,47 @@
+"""
+Deferred imports of heavy dependencies, with import-time accounting
+"""
+import importlib
+import threading
+import time
+from typing import Dict, Optional
+
+_timings: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def lazy_import(module_name: str):
+    """Import module_name on first use and record how long it took"""
+    # Always go through importlib: a module can already be in sys.modules
+    # while another thread is still initializing it, and import_module
+    # waits on the per-module import lock until it is complete
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    elapsed = time.perf_counter() - started
+    with _lock:
+        # The loading call is the slowest; later calls are cache hits
+        _timings[module_name] = max(_timings.get(module_name, 0.0), elapsed)
+    return module
+
+
+def optional_import(module_name: str):
+    """Like lazy_import, but return None when the module is not installed"""
+    try:
+        return lazy_import(module_name)
+    except ImportError:
+        return None
+
+
+def record_timing(name: str, seconds: float):
+    with _lock:
+        _timings[name] = seconds
+
+
+def import_report(total: Optional[float] = None) -> str:
+    """Human-readable summary of recorded import times, slowest first"""
+    lines = ["Import times:"]
+    for name, seconds in sorted(_timings.items(), key=lambda item: item[1], reverse=True):
+        lines.append(f"  {seconds * 1000:8.1f} ms  {name}")
+    if total is not None:
+        lines.append(f"  {total * 1000:8.1f} ms  total process time")
+    return "\n".join(lines)
@@ -0,0 +1,100 @@
+"""
+Rate-limited, retrying wrapper around the Groq chat completions client
+"""
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+from services.metrics import metrics, count_api_call
+from services.rate_limit import TokenBucket
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Rough token cost of one image in a vision request
+IMAGE_TOKEN_ESTIMATE = 1500
+
+
+class LLMUnavailableError(Exception):
+    """The LLM request still failed after all retries"""
+
+
+class RateLimitedLLMClient:
+    """Shared LLM client with request/token rate limits, bounded concurrency
+    and jittered exponential backoff that honors Retry-After."""
+
+    def __init__(self, client, requests_per_minute: int, tokens_per_minute: int,
+                 max_in_flight: int = 4, max_retries: int = 5,
+                 backoff_base: float = 1.0, backoff_max: float = 60.0):
+        self.client = client
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._in_flight = threading.BoundedSemaphore(max(1, max_in_flight))
+
+    def create_chat_completion(self, messages: List[Dict], **kwargs):
+        estimated_tokens = self.estimate_tokens(messages)
+
+        for attempt in range(self.max_retries + 1):
+            self.request_bucket.acquire(1)
+            self.token_bucket.acquire(estimated_tokens)
+            try:
+                with self._in_flight:
+                    count_api_call('groq', 'chat.completions')
+                    with metrics.timer('llm_request_seconds', help_text='Groq request latency'):
+                        response = self.client.chat.completions.create(messages=messages, **kwargs)
+            except Exception as error:
+                status = self._status_code(error)
+                metrics.inc('llm_errors_total', labels={'status': str(status or type(error).__name__)},
+                            help_text='Failed Groq requests')
+                if status is not None and status not in RETRYABLE_STATUS_CODES:
+                    raise
+                if attempt == self.max_retries:
+                    raise LLMUnavailableError(f"LLM request failed after {attempt + 1} attempts: {error}") from error
+
+                delay = self._retry_delay(error, attempt)
+                print(f"LLM request failed ({status or type(error).__name__}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            usage = getattr(response, 'usage', None)
+            if usage is not None and getattr(usage, 'total_tokens', None):
+                self.token_bucket.adjust(usage.total_tokens - estimated_tokens)
+                metrics.inc('llm_tokens_total', usage.total_tokens, help_text='Tokens used by Groq requests')
+            return response
+
+    @staticmethod
+    def estimate_tokens(messages: List[Dict]) -> int:
+        tokens = 0
+        for message in messages:
+            content = message.get('content', '')
+            if isinstance(content, str):
+                tokens += len(content) // 4
+                continue
+            for part in content:
+                if part.get('type') == 'image_url':
+                    tokens += IMAGE_TOKEN_ESTIMATE
+                else:
+                    tokens += len(part.get('text', '')) // 4
+        return max(1, tokens)
+
+    @staticmethod
+    def _status_code(error) -> Optional[int]:
+        status = getattr(error, 'status_code', None)
+        if status is None:
+            response = getattr(error, 'response', None)
+            status = getattr(response, 'status_code', None)
+        return status
+
+    def _retry_delay(self, error, attempt: int) -> float:
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None) or {}
+        retry_after = headers.get('retry-after')
+        if retry_after:
+            try:
+                return min(self.backoff_max, float(retry_after)) + random.uniform(0, 0.5)
+            except ValueError:
+                pass
+        # Full jitter exponential backoff
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
@@ -0,0 +1,213 @@
+"""
+Local mail archive (mbox file or directory of .eml files) as an email source
+"""
+import hashlib
+import mailbox
+import os
+import threading
+from collections import OrderedDict
+from email import policy
+from email.message import Message
+from email.parser import BytesParser
+from typing import BinaryIO, Dict, Iterator, List, Optional
+from config import ATTACHMENT_SPOOL_MAX_MEMORY, MESSAGE_PART_DEPTH
+from services.attachment_handle import AttachmentHandle
+from services.gmail_service import GmailService
+from services.metrics import metrics
+
+
+class LocalMailboxService(GmailService):
+    """Serves archived mail through the GmailService interface.
+
+    Messages are converted to Gmail-shaped payloads so attachment discovery
+    (MIME filter, size limit, part IDs) is exactly the live path's. Nothing
+    is marked in the archive; re-ingesting is safe because extraction is
+    cached by content, Drive uploads are deduplicated by hash and repeated
+    invoices are caught by the ledger.
+    """
+
+    supports_history = False
+
+    # Parsed messages kept between fetch and attachment downloads
+    PARSED_CACHE_SIZE = 256
+
+    def __init__(self, path: str, match_subject: bool = True):
+        super().__init__(None)
+        self.path = os.path.abspath(path)
+        self.match_subject = match_subject
+        self._mbox = None
+        self._mbox_lock = threading.Lock()
+        self._parsed = OrderedDict()  # message_id -> [message, downloads left]
+        self._parsed_lock = threading.Lock()
+        identity = self.path
+        if not os.path.isdir(self.path):
+            # mbox reads share one file handle, so they are serialized
+            self._mbox = mailbox.mbox(self.path, create=False)
+            # mbox keys are positions, so a rewritten file is a new archive
+            stat = os.stat(self.path)
+            identity += f":{stat.st_size}:{stat.st_mtime_ns}"
+        # IDs land in the shared work journal, so they must not collide
+        # with another archive's (or Gmail's) IDs
+        self._id_prefix = 'archive-' + hashlib.sha1(identity.encode()).hexdigest()[:12] + ':'
+
+    def get_or_create_label(self) -> Optional[str]:
+        return None
+
+    def get_history_id(self) -> Optional[str]:
+        return None
+
+    def iter_target_emails(self, query: Optional[str] = None, page_size: int = 0,
+                           max_messages: Optional[int] = None) -> Iterator[str]:
+        """Yield archive message IDs, checking only headers for the subject"""
+        yielded = 0
+        for message_id in self._iter_message_ids():
+            if max_messages is not None and yielded >= max_messages:
+                return
+            if self.match_subject:
+                headers = BytesParser(policy=policy.default).parsebytes(
+                    self._read_headers(message_id), headersonly=True
+                )
+                if not self.is_target_subject(headers.get('Subject', '')):
+                    continue
+            yielded += 1
+            yield message_id
+
+    def get_email_with_attachments(self, message_id: str) -> Dict:
+        try:
+            message = self._load_message(message_id)
+            email_data = self._parse_message(self._to_gmail_message(message_id, message))
+        except (OSError, KeyError, ValueError) as error:
+            print(f"Error reading archived email {message_id}: {error}")
+            return {}
+
+        if email_data['attachments']:
+            with self._parsed_lock:
+                self._parsed[message_id] = [message, len(email_data['attachments'])]
+                while len(self._parsed) > self.PARSED_CACHE_SIZE:
+                    self._parsed.popitem(last=False)
+        return email_data
+
+    def get_emails_with_attachments(self, message_ids: List[str]) -> List[Dict]:
+        emails = [self.get_email_with_attachments(message_id) for message_id in message_ids]
+        return [email_data for email_data in emails if email_data]
+
+    def download_attachment_handle(self, message_id: str, attachment: Dict) -> Optional[AttachmentHandle]:
+        try:
+            part = self._find_part(self._parsed_message(message_id), attachment['partId'])
+        except (OSError, KeyError, ValueError, IndexError) as error:
+            print(f"Error reading archived attachment: {error}")
+            return None
+
+        content = self._part_content(part)
+        if not content:
+            return None
+        handle = AttachmentHandle.from_bytes(content, ATTACHMENT_SPOOL_MAX_MEMORY)
+        metrics.inc('attachment_bytes_total', handle.size, {'source': 'archive'},
+                    'Attachment bytes received from Gmail')
+        return handle
+
+    def mark_as_processed(self, message_id: str) -> bool:
+        # Archives have no read state to change
+        return True
+
+    def mark_many_as_processed(self, message_ids: List[str]) -> List[str]:
+        return list(message_ids)
+
+    def _iter_message_ids(self) -> Iterator[str]:
+        if self._mbox is None:
+            for root, dirs, files in os.walk(self.path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith('.eml'):
+                        yield self._id_prefix + os.path.relpath(os.path.join(root, name), self.path)
+        else:
+            with self._mbox_lock:
+                keys = sorted(self._mbox.keys())
+            for key in keys:
+                yield f"{self._id_prefix}mbox-{key}"
+
+    def _locate(self, message_id: str) -> str:
+        """Relative .eml path or mbox-<key> for one of our message IDs"""
+        if not message_id.startswith(self._id_prefix):
+            raise KeyError(f"{message_id} is not from {self.path}")
+        return message_id[len(self._id_prefix):]
+
+    def _read_message(self, message_id: str) -> bytes:
+        location = self._locate(message_id)
+        if self._mbox is None:
+            with open(os.path.join(self.path, location), 'rb') as f:
+                return f.read()
+        with self._mbox_lock:
+            return self._mbox.get_bytes(int(location[len('mbox-'):]))
+
+    def _read_headers(self, message_id: str) -> bytes:
+        """Message bytes up to the end of the header block"""
+        location = self._locate(message_id)
+        if self._mbox is None:
+            with open(os.path.join(self.path, location), 'rb') as f:
+                return self._read_until_body(f)
+        with self._mbox_lock:
+            f = self._mbox.get_file(int(location[len('mbox-'):]))
+            try:
+                return self._read_until_body(f)
+            finally:
+                f.close()
+
+    @staticmethod
+    def _read_until_body(f: BinaryIO, chunk_size: int = 16 * 1024) -> bytes:
+        data = b''
+        while True:
+            chunk = f.read(chunk_size)
+            data += chunk
+            if not chunk or b'\n\n' in data or b'\r\n\r\n' in data:
+                return data
+
+    def _load_message(self, message_id: str) -> Message:
+        return BytesParser(policy=policy.default).parsebytes(self._read_message(message_id))
+
+    def _parsed_message(self, message_id: str) -> Message:
+        """Message parsed at fetch time, dropped after its last download"""
+        with self._parsed_lock:
+            entry = self._parsed.get(message_id)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self._parsed[message_id]
+                return entry[0]
+        # Evicted, or a resumed job whose message was never fetched here
+        return self._load_message(message_id)
+
+    def _to_gmail_message(self, message_id: str, message: Message) -> Dict:
+        payload = self._to_gmail_payload(message, '', MESSAGE_PART_DEPTH)
+        payload['headers'] = [{'name': name, 'value': str(value)} for name, value in message.items()]
+        return {'id': message_id, 'payload': payload}
+
+    def _to_gmail_payload(self, part: Message, part_id: str, depth: int) -> Dict:
+        payload = {
+            'partId': part_id,
+            'mimeType': part.get_content_type(),
+            'filename': part.get_filename() or '',
+        }
+        # Attached emails stay whole, like Gmail's message/rfc822 parts
+        if part.is_multipart() and not payload['filename'] and depth > 0:
+            payload['parts'] = [
+                self._to_gmail_payload(child, f"{part_id}.{index}" if part_id else str(index), depth - 1)
+                for index, child in enumerate(part.get_payload())
+            ]
+        else:
+            size = len(self._part_content(part)) if payload['filename'] else 0
+            payload['body'] = {'attachmentId': part_id, 'size': size}
+        return payload
+
+    @staticmethod
+    def _find_part(message: Message, part_id: str) -> Message:
+        part = message
+        for index in filter(None, part_id.split('.')):
+            part = part.get_payload()[int(index)]
+        return part
+
+    @staticmethod
+    def _part_content(part: Message) -> bytes:
+        if part.get_content_type() == 'message/rfc822':
+            return part.get_payload()[0].as_bytes()
+        return part.get_payload(decode=True) or b''
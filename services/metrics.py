@@ -0,0 +1,208 @@
+"""
+In-process metrics: counters, gauges and timing histograms per stage.
+
+Exposed as Prometheus text (file or local HTTP endpoint) and as a JSON
+summary written at the end of each run.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Optional[Dict[str, str]]) -> LabelKey:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Dict[str, str]] = None) -> str:
+    items = list(key) + sorted((extra or {}).items())
+    if not items:
+        return ''
+    escaped = (
+        name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in items
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+        self.values = []  # kept for percentiles in the run summary
+
+    def observe(self, value: float):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.total += value
+        self.count += 1
+        self.values.append(value)
+
+    def percentile(self, fraction: float) -> float:
+        if not self.values:
+            return 0.0
+        ordered = sorted(self.values)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = 'invoice'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._help: Dict[str, str] = {}
+        self.run_started = time.time()
+
+    def inc(self, name: str, amount: float = 1, labels: Optional[Dict[str, str]] = None,
+            help_text: str = ''):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + amount
+            self._help.setdefault(name, help_text)
+
+    def set_gauge(self, name: str, value: float, labels: Optional[Dict[str, str]] = None,
+                  help_text: str = ''):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+            self._help.setdefault(name, help_text)
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None,
+                help_text: str = ''):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = _label_key(labels)
+            if key not in series:
+                series[key] = _Histogram(DEFAULT_BUCKETS)
+            series[key].observe(value)
+            self._help.setdefault(name, help_text)
+
+    @contextmanager
+    def timer(self, name: str, labels: Optional[Dict[str, str]] = None, help_text: str = ''):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, labels, help_text)
+
+    def reset(self):
+        """Start a new run; the previous run's values are discarded"""
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+            self.run_started = time.time()
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for kind, metrics in (('counter', self._counters), ('gauge', self._gauges)):
+                for name, series in sorted(metrics.items()):
+                    full_name = f"{self.prefix}_{name}"
+                    if self._help.get(name):
+                        lines.append(f"# HELP {full_name} {self._help[name]}")
+                    lines.append(f"# TYPE {full_name} {kind}")
+                    for key, value in sorted(series.items()):
+                        lines.append(f"{full_name}{_format_labels(key)} {value}")
+
+            for name, series in sorted(self._histograms.items()):
+                full_name = f"{self.prefix}_{name}"
+                if self._help.get(name):
+                    lines.append(f"# HELP {full_name} {self._help[name]}")
+                lines.append(f"# TYPE {full_name} histogram")
+                for key, histogram in sorted(series.items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f"{full_name}_bucket{_format_labels(key, {'le': str(bound)})} {count}")
+                    lines.append(f"{full_name}_bucket{_format_labels(key, {'le': '+Inf'})} {histogram.count}")
+                    lines.append(f"{full_name}_sum{_format_labels(key)} {histogram.total}")
+                    lines.append(f"{full_name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict:
+        """JSON-friendly snapshot with p50/p99 for every histogram"""
+        def series_name(name, key):
+            return name + ''.join(f"[{label}={value}]" for label, value in key)
+
+        with self._lock:
+            return {
+                'run_started': self.run_started,
+                'duration_seconds': time.time() - self.run_started,
+                'counters': {
+                    series_name(name, key): value
+                    for name, series in self._counters.items() for key, value in series.items()
+                },
+                'gauges': {
+                    series_name(name, key): value
+                    for name, series in self._gauges.items() for key, value in series.items()
+                },
+                'timings': {
+                    series_name(name, key): {
+                        'count': histogram.count,
+                        'total': histogram.total,
+                        'p50': histogram.percentile(0.5),
+                        'p99': histogram.percentile(0.99),
+                    }
+                    for name, series in self._histograms.items() for key, histogram in series.items()
+                },
+            }
+
+    def write_textfile(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def write_summary(self, directory: str) -> str:
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.run_started))
+        # Backfill workers finish runs concurrently, so include the pid
+        path = os.path.join(directory, f"run-{stamp}-{os.getpid()}.json")
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+        return path
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+        """Serve /metrics in Prometheus text format from a daemon thread"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving metrics on http://{host}:{port}/metrics")
+        return server
+
+
+# Process-wide registry used by app.py and all services
+metrics = MetricsRegistry()
+
+
+def count_api_call(service: str, endpoint: str, amount: int = 1):
+    """Record API calls about to be made"""
+    metrics.inc('api_calls_total', amount, {'service': service, 'endpoint': endpoint},
+                'Google/Groq API calls by endpoint')
@@ -0,0 +1,122 @@
+"""
+Bounded, multi-stage worker pipeline
+"""
+import contextvars
+import queue
+import threading
+import time
+from typing import Callable, Iterable, List, Optional
+from services.metrics import metrics
+
+_STOP = object()
+
+
+class Stage:
+    """A pipeline stage: a handler run by a fixed number of worker threads.
+
+    The handler receives one item and returns the item(s) for the next stage:
+    ``None`` drops the item, a list fans it out into several items and any
+    other value is passed on as-is.
+    """
+
+    def __init__(self, name: str, handler: Callable, workers: int = 1, queue_size: int = 0):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+
+
+class StagedPipeline:
+    def __init__(self, stages: List[Stage],
+                 on_done: Optional[Callable[[object, bool], None]] = None):
+        """
+        on_done(item, ok) is called once per item leaving the pipeline: with
+        ok=True for items returned by the last stage, ok=False for items
+        dropped or failed by any stage.
+        """
+        self.stages = stages
+        self.on_done = on_done
+        self._queues = []
+        self._remaining = []
+        self._lock = threading.Lock()
+
+    def run(self, source: Iterable):
+        """Feed items from source through all stages and block until drained"""
+        self._queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        self._remaining = [stage.workers for stage in self.stages]
+
+        threads = []
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                # Workers inherit the caller's context (e.g. its account budget)
+                thread = threading.Thread(
+                    target=contextvars.copy_context().run, args=(self._worker, index),
+                    name=f"{stage.name}-{n}", daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+
+        try:
+            # The first queue is bounded, so a lazy source is only consumed
+            # as fast as the first stage can keep up
+            for item in source:
+                self._queues[0].put(item)
+        finally:
+            for _ in range(self.stages[0].workers):
+                self._queues[0].put(_STOP)
+            for thread in threads:
+                thread.join()
+
+    def queue_depths(self) -> dict:
+        return {stage.name: q.qsize() for stage, q in zip(self.stages, self._queues)}
+
+    def _worker(self, index: int):
+        stage = self.stages[index]
+        inbox = self._queues[index]
+        is_last = index == len(self.stages) - 1
+
+        while True:
+            item = inbox.get()
+            if item is _STOP:
+                break
+            metrics.set_gauge('queue_depth', inbox.qsize(), {'stage': stage.name},
+                              'Items waiting in each pipeline queue')
+
+            started = time.perf_counter()
+            try:
+                result = stage.handler(item)
+            except Exception as e:
+                print(f"Error in {stage.name} stage: {e}")
+                result = None
+            metrics.observe('stage_seconds', time.perf_counter() - started, {'stage': stage.name},
+                            'Time spent per item in each pipeline stage')
+            metrics.inc('stage_items_total', labels={
+                'stage': stage.name, 'result': 'dropped' if result is None else 'ok'
+            }, help_text='Items handled by each pipeline stage')
+
+            if result is None:
+                self._finish(item, False)
+                continue
+
+            outputs = result if isinstance(result, list) else [result]
+            for output in outputs:
+                if is_last:
+                    self._finish(output, True)
+                else:
+                    self._queues[index + 1].put(output)
+
+        # Last worker of this stage to exit shuts down the next stage
+        with self._lock:
+            self._remaining[index] -= 1
+            last_worker = self._remaining[index] == 0
+        if last_worker and not is_last:
+            for _ in range(self.stages[index + 1].workers):
+                self._queues[index + 1].put(_STOP)
+
+    def _finish(self, item, ok: bool):
+        if not self.on_done:
+            return
+        try:
+            self.on_done(item, ok)
+        except Exception as e:
+            print(f"Error completing pipeline item: {e}")
@@ -0,0 +1,98 @@
+"""
+Token-bucket rate limiting and the Google API call budgets (process-wide
+and per account)
+"""
+import contextvars
+import threading
+import time
+from typing import Optional
+from config import GOOGLE_API_CALLS_PER_MINUTE
+
+# Services whose calls count against the Google API budget
+GOOGLE_SERVICES = {'gmail', 'drive', 'sheets'}
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at capacity per minute"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1):
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def adjust(self, amount: float):
+        """Charge (positive) or refund (negative) tokens after the fact"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class AccountBudget:
+    """One mailbox's Google API allowance and running call count"""
+
+    def __init__(self, name: str, per_minute: float = 0):
+        self.name = name
+        self.bucket = TokenBucket(per_minute) if per_minute > 0 else None
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def charge(self, amount: int):
+        if self.bucket is not None:
+            self.bucket.acquire(amount)
+        with self._lock:
+            self.calls += amount
+
+
+_api_budget: Optional[TokenBucket] = (
+    TokenBucket(GOOGLE_API_CALLS_PER_MINUTE) if GOOGLE_API_CALLS_PER_MINUTE > 0 else None
+)
+
+# Account whose calls are being made; pipeline threads inherit it
+_account_budget: contextvars.ContextVar = contextvars.ContextVar('account_budget', default=None)
+
+
+def set_api_budget(per_minute: float):
+    """Cap Google API calls made by this process per minute (0 for no cap)"""
+    global _api_budget
+    _api_budget = TokenBucket(per_minute) if per_minute > 0 else None
+
+
+def use_account_budget(budget: Optional[AccountBudget]) -> contextvars.Token:
+    """Charge calls in the current context to budget; pass the returned
+    token to release_account_budget when done"""
+    return _account_budget.set(budget)
+
+
+def release_account_budget(token: contextvars.Token):
+    _account_budget.reset(token)
+
+
+def charge_api_calls(service: str, amount: int = 1):
+    """Block until the account and process budgets allow amount more calls
+    to service"""
+    if service not in GOOGLE_SERVICES:
+        return
+    account = _account_budget.get()
+    if account is not None:
+        account.charge(amount)
+    budget = _api_budget
+    if budget is not None:
+        budget.acquire(amount)
@@ -0,0 +1,155 @@
+"""
+Local rule-based invoice field extraction for text content
+"""
+import html
+import re
+from typing import Dict, List, Optional, Tuple
+
+_MONTHS = r'(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?'
+_DATE = (
+    r'(\d{4}-\d{1,2}-\d{1,2}'
+    r'|\d{1,2}[./-]\d{1,2}[./-]\d{2,4}'
+    rf'|\d{{1,2}}(?:st|nd|rd|th)?\s+{_MONTHS},?\s+\d{{4}}'
+    rf'|{_MONTHS}\s+\d{{1,2}}(?:st|nd|rd|th)?,?\s+\d{{4}})'
+)
+_CURRENCY = r'(\$|€|£|₹|¥|USD|EUR|GBP|INR|JPY|CAD|AUD|Rs\.?)'
+# Thousands separators never include a newline, so an amount stops at its line
+_NUMBER = r'(\d{1,3}(?:[,. ]\d{3})*(?:[.,]\d{1,2})?|\d+(?:[.,]\d{1,2})?)'
+# An invoice number: one or more ID characters, at least one of them a digit
+_INVOICE_NO = r'((?=[A-Z0-9\-/_.]*\d)[A-Z0-9](?:[A-Z0-9\-/_.]{0,30}[A-Z0-9])?)'
+_COMPANY_LINE = (
+    r'[A-Z][\w&.,\'\- ]{1,60}?\b(?:Inc|LLC|Ltd|Limited|GmbH|Corp|Corporation'
+    r'|Company|Co|Pvt|PLC|LLP|S\.A|B\.V|AG)\b\.?'
+)
+# Lines at the top of the (normalized) text treated as the letterhead
+_HEADER_LINES = 5
+_SENDER_RE = re.compile(r'^\s*from\s*:\s*"?([^"<\n@]{2,80}?)"?\s*<', re.IGNORECASE | re.MULTILINE)
+
+CURRENCY_CODES = {
+    '$': 'USD', '€': 'EUR', '£': 'GBP', '₹': 'INR', '¥': 'JPY',
+    'rs': 'INR', 'rs.': 'INR',
+}
+
+# (pattern, confidence) pairs, strongest first within each field
+_PATTERNS: Dict[str, List[Tuple[re.Pattern, float]]] = {
+    'invoice_number': [
+        (re.compile(
+            r'\b(?:invoice|inv|bill)\.?\s*(?:(?:number|num|no)\b\.?|#)\s*[:#.\-]?\s*'
+            + _INVOICE_NO, re.IGNORECASE), 0.9),
+        (re.compile(r'\b(?:invoice|bill)\s*[:#]\s*' + _INVOICE_NO, re.IGNORECASE), 0.7),
+    ],
+    'invoice_date': [
+        (re.compile(rf'\b(?:invoice|bill)\s*date\s*[:\-]?\s*{_DATE}', re.IGNORECASE), 0.95),
+        (re.compile(rf'\bdate\s*(?:of\s+issue)?\s*[:\-]?\s*{_DATE}', re.IGNORECASE), 0.8),
+        (re.compile(rf'\b{_DATE}\b', re.IGNORECASE), 0.5),
+    ],
+    'total_amount': [
+        (re.compile(
+            rf'\b(?:grand\s+total|total\s+amount|amount\s+due|balance\s+due|total\s+due)'
+            rf'\s*(?:\([^)]*\))?\s*[:\-]?\s*{_CURRENCY}?\s*{_NUMBER}\s*{_CURRENCY}?',
+            re.IGNORECASE), 0.95),
+        (re.compile(
+            rf'(?<!sub)(?<!sub\s)\btotal\s*[:\-]?\s*{_CURRENCY}?\s*{_NUMBER}\s*{_CURRENCY}?',
+            re.IGNORECASE), 0.8),
+    ],
+    'vendor_name': [
+        (re.compile(
+            r'^\s*(?:vendor|supplier|seller|company|billed\s+by|bill\s+from|issued\s+by)'
+            r'\s*[:\-]\s*(.{2,80}?)\s*$', re.IGNORECASE | re.MULTILINE), 0.85),
+        # A company name on its own line in the header block is the issuer;
+        # further down it is as likely to be the customer
+        (re.compile(
+            rf'\A(?:[^\n]*\n){{0,{_HEADER_LINES - 1}}}?\s*({_COMPANY_LINE})\s*$', re.MULTILINE), 0.85),
+        (re.compile(rf'^\s*({_COMPANY_LINE})\s*$', re.MULTILINE), 0.7),
+        (_SENDER_RE, 0.6),
+    ],
+}
+
+# Sender display name agreeing with the body is as good as a labelled vendor
+_SENDER_AGREES_CONFIDENCE = 0.85
+
+_TAG_RE = re.compile(r'<(script|style)\b.*?</\1>|<[^>]+>', re.IGNORECASE | re.DOTALL)
+_BLANK_RE = re.compile(r'[ \t\r\f\v]+')
+
+
+class RuleBasedExtractor:
+    """Extracts invoice fields with precompiled patterns.
+
+    Returns the fields together with a 0-1 confidence per field, so callers
+    can decide whether an LLM fallback is needed.
+    """
+
+    FIELDS = ('vendor_name', 'invoice_date', 'total_amount', 'invoice_number')
+
+    def extract(self, text: str) -> Tuple[Dict[str, str], Dict[str, float]]:
+        text = self.normalize_text(text)
+        fields = {field: 'N/A' for field in self.FIELDS}
+        confidence = {field: 0.0 for field in self.FIELDS}
+
+        for field, patterns in _PATTERNS.items():
+            for pattern, score in patterns:
+                value = self._first_match(field, pattern, text)
+                if value:
+                    fields[field] = value
+                    confidence[field] = score
+                    break
+
+        self._check_sender(text, fields, confidence)
+        return fields, confidence
+
+    @staticmethod
+    def _check_sender(text: str, fields: Dict[str, str], confidence: Dict[str, float]):
+        """Raise vendor confidence when the email sender names the same company
+        as the invoice body"""
+        if confidence['vendor_name'] >= _SENDER_AGREES_CONFIDENCE:
+            return
+        sender = _SENDER_RE.search(text)
+        if not sender:
+            return
+        name = sender.group(1).strip()
+        body = text[:sender.start()] + text[sender.end():]
+        if len(name) > 2 and name.lower() in body.lower():
+            fields['vendor_name'] = name
+            confidence['vendor_name'] = _SENDER_AGREES_CONFIDENCE
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """Strip HTML markup and collapse whitespace runs"""
+        if '<' in text and '>' in text:
+            text = html.unescape(_TAG_RE.sub('\n', text))
+        return '\n'.join(
+            line for line in (_BLANK_RE.sub(' ', raw).strip() for raw in text.splitlines()) if line
+        )
+
+    def _first_match(self, field: str, pattern: re.Pattern, text: str) -> Optional[str]:
+        if field != 'total_amount':
+            match = pattern.search(text)
+            return match.group(1).strip() if match else None
+
+        # Totals often repeat (e.g. per page), the last one is the final amount
+        matches = list(pattern.finditer(text))
+        if not matches:
+            return None
+        currency_before, number, currency_after = matches[-1].groups()
+        return self.normalize_amount(number, currency_before or currency_after)
+
+    @staticmethod
+    def normalize_amount(number: str, currency: Optional[str] = None) -> Optional[str]:
+        """Normalize '1.234,56' / '1,234.56' style amounts to '1234.56 EUR'"""
+        number = number.replace(' ', '')
+        last_sep = max(number.rfind(','), number.rfind('.'))
+        if last_sep != -1 and len(number) - last_sep - 1 in (1, 2):
+            integer, fraction = number[:last_sep], number[last_sep + 1:]
+        else:
+            integer, fraction = number, ''
+        integer = re.sub(r'[.,]', '', integer)
+        try:
+            amount = float(f"{integer}.{fraction or '0'}")
+        except ValueError:
+            return None
+
+        value = f"{amount:.2f}"
+        if currency:
+            code = CURRENCY_CODES.get(currency.lower(), currency.upper())
+            value = f"{value} {code}"
+        return value
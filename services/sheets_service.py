@@ -1,45 +1,150 @@
 """
 Google Sheets Service for logging data
 """
+import contextvars
 import logging
+import re
+import threading
+import time
 from datetime import datetime
-from typing import Dict
+from typing import Callable, Dict, List, Optional, Tuple
 from googleapiclient.errors import HttpError
 from config import SPREADSHEET_ID
+from services.metrics import metrics, count_api_call
+from services.rate_limit import charge_api_calls
+from services.rule_extractor import RuleBasedExtractor
+
+_AMOUNT_RE = re.compile(r'\d(?:[\d.,]|\s(?=\d))*')
+
+
+class LedgerIndex:
+    """In-memory set of (vendor, invoice number, amount) keys already in the ledger"""
+    
+    def __init__(self):
+        self._keys = set()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(vendor, invoice_number, amount) -> Optional[Tuple[str, str, str]]:
+        """Normalized key, or None when the invoice number is unknown"""
+        number = re.sub(r'\W', '', str(invoice_number or '')).lower()
+        if not number or number == 'na':
+            return None
+        vendor = re.sub(r'\W', '', str(vendor or '')).lower()
+        # Same normalization as the rules, so '1.234,56 EUR' from the LLM
+        # and '1234.56 EUR' from the rules give the same key
+        match = _AMOUNT_RE.search(str(amount or ''))
+        if match:
+            amount = RuleBasedExtractor.normalize_amount(match.group(0).rstrip('.,')) or match.group(0)
+        else:
+            amount = ''
+        return vendor, number, amount
+    
+    def add_row(self, row: List):
+        """Index a ledger row (columns A:G as written by build_row)"""
+        padded = list(row) + [''] * (5 - len(row))
+        key = self.make_key(padded[4], padded[2], padded[3])
+        if key:
+            with self._lock:
+                self._keys.add(key)
+    
+    def check_and_add(self, invoice_data: Dict) -> bool:
+        """Return True if the invoice is already indexed, otherwise index it"""
+        key = self._key_for(invoice_data)
+        if key is None:
+            return False
+        with self._lock:
+            if key in self._keys:
+                return True
+            self._keys.add(key)
+            return False
+    
+    def discard(self, invoice_data: Dict):
+        """Forget an invoice whose row ended up not being written"""
+        key = self._key_for(invoice_data)
+        if key:
+            with self._lock:
+                self._keys.discard(key)
+    
+    def __len__(self) -> int:
+        return len(self._keys)
+    
+    def _key_for(self, invoice_data: Dict):
+        return self.make_key(
+            invoice_data.get('vendor_name'),
+            invoice_data.get('invoice_number'),
+            invoice_data.get('total_amount')
+        )
 
 
 class SheetsService:
-    def __init__(self, sheets_service):
+    def __init__(self, sheets_service, spreadsheet_id: str = SPREADSHEET_ID):
         self.service = sheets_service
+        self.spreadsheet_id = spreadsheet_id
+        self.ledger = LedgerIndex()
         self.setup_headers()
     
-    def log_processed_data(self, invoice_data: Dict, file_url: str, file_type: str):
-        """Log processed invoice data to Google Sheets"""
+    def load_ledger_index(self) -> LedgerIndex:
+        """Read the existing ledger once and rebuild the duplicate index"""
+        ledger = LedgerIndex()
         try:
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            charge_api_calls('sheets')
+            count_api_call('sheets', 'values.get')
+            result = self.service.spreadsheets().values().get(
+                spreadsheetId=self.spreadsheet_id,
+                range='A2:G'
+            ).execute()
             
-            # Prepare row data matching the required columns
-            row_data = [
-                timestamp,
-                invoice_data.get('invoice_date', 'N/A'),
-                invoice_data.get('invoice_number', 'N/A'),
-                invoice_data.get('total_amount', 'N/A'),
-                invoice_data.get('vendor_name', 'N/A'),
-                file_url,
-                file_type
-            ]
+            for row in result.get('values', []):
+                ledger.add_row(row)
+            print(f"Loaded {len(ledger)} invoices into duplicate index")
             
-            # Append to sheet
-            body = {'values': [row_data]}
+        except HttpError as error:
+            print(f"Error loading ledger for duplicate detection: {error}")
+        
+        self.ledger = ledger
+        return ledger
+    
+    def log_processed_data(self, invoice_data: Dict, file_url: str, file_type: str):
+        """Log processed invoice data to Google Sheets"""
+        success = self.append_rows([self.build_row(invoice_data, file_url, file_type)])
+        if success:
+            print(f"Logged data for vendor: {invoice_data.get('vendor_name', 'Unknown')}")
+        return success
+    
+    def build_row(self, invoice_data: Dict, file_url: str, file_type: str,
+                  note: str = '') -> List:
+        """Prepare row data matching the required columns"""
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        row = [
+            timestamp,
+            invoice_data.get('invoice_date', 'N/A'),
+            invoice_data.get('invoice_number', 'N/A'),
+            invoice_data.get('total_amount', 'N/A'),
+            invoice_data.get('vendor_name', 'N/A'),
+            file_url,
+            file_type
+        ]
+        if note:
+            row.append(note)
+        return row
+    
+    def append_rows(self, rows: List[List]) -> bool:
+        """Append rows in a single values.append request"""
+        try:
+            body = {'values': rows}
             
-            result = self.service.spreadsheets().values().append(
-                spreadsheetId=SPREADSHEET_ID,
-                range='A:G',  # Columns A through G
+            charge_api_calls('sheets')
+            count_api_call('sheets', 'values.append')
+            self.service.spreadsheets().values().append(
+                spreadsheetId=self.spreadsheet_id,
+                range='A:H',  # Columns A through H
                 valueInputOption='RAW',
+                insertDataOption='INSERT_ROWS',
                 body=body
             ).execute()
             
-            print(f"Logged data for vendor: {invoice_data.get('vendor_name', 'Unknown')}")
+            metrics.inc('sheet_rows_total', len(rows), {'result': 'committed'}, 'Ledger rows appended')
             return True
             
         except HttpError as error:
@@ -52,12 +157,26 @@ class SheetsService:
     def setup_headers(self):
         try:
             # Check if header already exists
+            charge_api_calls('sheets')
+            count_api_call('sheets', 'values.get')
             result = self.service.spreadsheets().values().get(
-                spreadsheetId=SPREADSHEET_ID,
-                range='A1:G1'
+                spreadsheetId=self.spreadsheet_id,
+                range='A1:H1'
             ).execute()
             
-            if not result.get('values', []):
+            existing = result.get('values', [])
+            if existing and len(existing[0]) < 8:
+                # Sheets created before the Notes column only need H1
+                charge_api_calls('sheets')
+                count_api_call('sheets', 'values.update')
+                self.service.spreadsheets().values().update(
+                    spreadsheetId=self.spreadsheet_id,
+                    range='H1',
+                    valueInputOption='RAW',
+                    body={'values': [['Notes']]}
+                ).execute()
+                print("Added Notes header")
+            elif not existing:
                 headers = [
                     'Timestamp',
                     'Invoice/Bill Date', 
@@ -65,13 +184,16 @@ class SheetsService:
                     'Amount',
                     'Vendor/Company Name',
                     'Drive File URL',
-                    'File Type'
+                    'File Type',
+                    'Notes'
                 ]
                 body = {'values': [headers]}
                 
+                charge_api_calls('sheets')
+                count_api_call('sheets', 'values.update')
                 result = self.service.spreadsheets().values().update(
-                    spreadsheetId=SPREADSHEET_ID,
-                    range='A1:G1',
+                    spreadsheetId=self.spreadsheet_id,
+                    range='A1:H1',
                     valueInputOption='RAW',
                     body=body
                 ).execute()
@@ -83,4 +205,75 @@ class SheetsService:
             
         except HttpError as error:
             print(f"Error setting up headers: {error}")
-            return False
\ No newline at end of file
+            return False
+
+
+class BufferedSheetWriter:
+    """Accumulates rows and appends them in one request.
+    
+    Buffered rows are flushed when max_rows is reached, when the oldest row
+    is older than max_age_seconds, and on close(). on_commit(token, ok) is
+    called for every row once its append has succeeded or failed.
+    """
+    
+    def __init__(self, sheets_service: SheetsService, on_commit: Callable,
+                 max_rows: int = 100, max_age_seconds: float = 30.0):
+        self.sheets_service = sheets_service
+        self.on_commit = on_commit
+        self.max_rows = max(1, max_rows)
+        self.max_age_seconds = max_age_seconds
+        self._rows = []
+        self._tokens = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        # Run in the caller's context so API calls stay on its account budget
+        self._timer = threading.Thread(
+            target=contextvars.copy_context().run, args=(self._flush_aged_rows,), daemon=True
+        )
+        self._timer.start()
+    
+    def add(self, row: List, token):
+        with self._lock:
+            if not self._rows:
+                self._oldest = time.monotonic()
+            self._rows.append(row)
+            self._tokens.append(token)
+            full = len(self._rows) >= self.max_rows
+            metrics.set_gauge('queue_depth', len(self._rows), {'stage': 'sheet_buffer'})
+        if full:
+            self.flush()
+    
+    def flush(self):
+        # Serialize flushes so rows are appended in the order they were added
+        with self._flush_lock:
+            with self._lock:
+                rows, tokens = self._rows, self._tokens
+                self._rows, self._tokens, self._oldest = [], [], None
+            if not rows:
+                return
+            
+            with metrics.timer('sheet_flush_seconds', help_text='Time to append one buffered batch'):
+                success = self.sheets_service.append_rows(rows)
+            if not success:
+                metrics.inc('sheet_rows_total', len(rows), {'result': 'failed'})
+            print(f"{'Logged' if success else 'Failed to log'} {len(rows)} rows to sheet")
+            for token in tokens:
+                try:
+                    self.on_commit(token, success)
+                except Exception as e:
+                    print(f"Error handling committed row: {e}")
+    
+    def close(self):
+        self._closed.set()
+        self._timer.join()
+        self.flush()
+    
+    def _flush_aged_rows(self):
+        interval = max(0.5, self.max_age_seconds / 4)
+        while not self._closed.wait(interval):
+            with self._lock:
+                aged = self._oldest is not None and time.monotonic() - self._oldest >= self.max_age_seconds
+            if aged:
+                self.flush()
@@ -0,0 +1,35 @@
+"""
+Local checkpoint storage for incremental Gmail sync
+"""
+import json
+import os
+from typing import Optional
+
+
+class SyncCheckpoint:
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Optional[str]:
+        """Return the last saved Gmail historyId, if any"""
+        try:
+            with open(self.path) as f:
+                return json.load(f).get('history_id')
+        except FileNotFoundError:
+            return None
+        except (ValueError, OSError) as e:
+            print(f"Ignoring unreadable sync checkpoint: {e}")
+            return None
+
+    def save(self, history_id: str):
+        # Write then rename so a crash never leaves a truncated checkpoint
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'history_id': str(history_id)}, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,87 @@
+"""
+Durable per-attachment work journal for crash-safe resume
+"""
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+# Stages in pipeline order; a journal entry holds the last completed one
+DOWNLOADED = 'downloaded'
+EXTRACTED = 'extracted'
+UPLOADED = 'uploaded'
+LOGGED = 'logged'
+
+STAGE_ORDER = {DOWNLOADED: 1, EXTRACTED: 2, UPLOADED: 3, LOGGED: 4}
+
+
+def reached(stage: Optional[str], target: str) -> bool:
+    """Whether stage is target or a later stage"""
+    return STAGE_ORDER.get(stage, 0) >= STAGE_ORDER[target]
+
+
+class WorkJournal:
+    """SQLite journal of the last completed stage for each attachment"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            '''CREATE TABLE IF NOT EXISTS attachments (
+                key TEXT PRIMARY KEY,
+                email_id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                invoice_data TEXT,
+                file_url TEXT,
+                updated_at REAL NOT NULL
+            )'''
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS attachments_email ON attachments (email_id)'
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT stage, invoice_data, file_url FROM attachments WHERE key = ?', (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'stage': row[0],
+            'invoice_data': json.loads(row[1]) if row[1] else {},
+            'file_url': row[2] or '',
+        }
+
+    def record(self, key: str, email_id: str, stage: str,
+               invoice_data: Optional[Dict] = None, file_url: Optional[str] = None):
+        """Record a completed stage, keeping earlier results not passed in"""
+        with self._lock:
+            self._conn.execute(
+                '''INSERT INTO attachments (key, email_id, stage, invoice_data, file_url, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(key) DO UPDATE SET
+                       stage = excluded.stage,
+                       invoice_data = COALESCE(excluded.invoice_data, attachments.invoice_data),
+                       file_url = COALESCE(excluded.file_url, attachments.file_url),
+                       updated_at = excluded.updated_at''',
+                (
+                    key, email_id, stage,
+                    json.dumps(invoice_data) if invoice_data is not None else None,
+                    file_url, time.time()
+                )
+            )
+            self._conn.commit()
+
+    def forget_emails(self, email_ids: Iterable[str]):
+        """Drop entries for emails that are fully processed and marked"""
+        with self._lock:
+            self._conn.executemany(
+                'DELETE FROM attachments WHERE email_id = ?',
+                [(email_id,) for email_id in email_ids]
+            )
+            self._conn.commit()
@@ -0,0 +1,17 @@
+import pytest
+
+from services.sheets_service import LedgerIndex
+
+
+@pytest.mark.parametrize('amount', ['1.234,56 EUR', '1234.56 EUR', '€ 1 234,56', '$1,234.56'])
+def test_amount_formats_share_a_key(amount):
+    assert LedgerIndex.make_key('Acme Ltd', 'INV-1', amount) == ('acmeltd', 'inv1', '1234.56')
+
+
+def test_different_cents_are_different_invoices():
+    index = LedgerIndex()
+    first = {'vendor_name': 'Acme Ltd', 'invoice_number': 'INV-1', 'total_amount': '1.234,56 EUR'}
+    second = dict(first, total_amount='1.234,99 EUR')
+    assert not index.check_and_add(first)
+    assert not index.check_and_add(second)
+    assert index.check_and_add(dict(first, total_amount='1234.56 EUR'))
@@ -0,0 +1,43 @@
+import pytest
+
+from services.rule_extractor import RuleBasedExtractor
+
+
+@pytest.fixture
+def extractor():
+    return RuleBasedExtractor()
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('Invoice Number 42', '42'),
+    ('Bill number: 9', '9'),
+    ('INVOICE NUMBER: 1', '1'),
+    ('Invoice No: INV-20000', 'INV-20000'),
+    ('Inv. No. A7', 'A7'),
+    ('Invoice: 77', '77'),
+])
+def test_invoice_number(extractor, text, expected):
+    fields, confidence = extractor.extract(text)
+    assert fields['invoice_number'] == expected
+    assert confidence['invoice_number'] > 0
+
+
+@pytest.mark.parametrize('text', [
+    'Invoice No: ABC',
+    'Invoice numbering policy',
+])
+def test_invoice_number_needs_a_digit(extractor, text):
+    fields, confidence = extractor.extract(text)
+    assert fields['invoice_number'] == 'N/A'
+    assert confidence['invoice_number'] == 0.0
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('Total: $1,234.56', '1234.56 USD'),
+    ('Total: 1.234,56 EUR', '1234.56 EUR'),
+    ('Total: 1 234,56 EUR', '1234.56 EUR'),
+    ('Total Due: 45\n123 Main St', '45.00'),
+])
+def test_total_amount(extractor, text, expected):
+    fields, _ = extractor.extract(text)
+    assert fields['total_amount'] == expected